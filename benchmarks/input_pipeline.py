@@ -0,0 +1,224 @@
+""" input pipeline benchmark, no model is built
+
+    $ python3 benchmarks/input_pipeline.py --nn cnn,rnn --num_threads 1,2,4 \
+          --batch_sizes 32,128 --num_batches 500
+
+    Only read_batch_sequences of SRCNN and Multi_Task_Seq2Seq runs, on the
+    .tfrecords of data/, for every combination of reader threads and batch
+    size. Examples/sec and batches/sec are reported every --report_every
+    batches together with how full the input buffer is:
+
+    * rnn: size of the shuffle_batch queue, read after every batch
+    * cnn: tf.data does not expose the prefetch buffer, so the time spent
+      waiting for the next batch is reported instead, a batch that was
+      already prefetched is returned in well under a millisecond
+
+    --step_seconds sleeps after every batch to stand in for the training step,
+    the buffers only fill up when the pipeline is faster than that.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_dir)
+
+from lib.multi_task_seq2seq_model import Multi_Task_Seq2Seq
+from lib.srcnn_model import SRCNN
+
+# a batch waiting less than this was already in the prefetch buffer
+READY_SECONDS = 1e-3
+
+class SRCNNReader(SRCNN):
+    """ only the input pipeline of SRCNN """
+    def __init__(self, para):
+        self.para = para
+        self.dtype = tf.float32
+
+class Multi_Task_Seq2SeqReader(Multi_Task_Seq2Seq):
+    """ only the input pipeline of Multi_Task_Seq2Seq """
+    def __init__(self, para):
+        self.para = para
+        self.dtype = tf.float32
+
+def reader_para(args, nn, num_threads, batch_size):
+    """ the parameters read_batch_sequences uses, as lib/config.py sets them """
+    return argparse.Namespace(
+        nn=nn,
+        mode=args.mode,
+        batch_size=batch_size,
+        max_len=args.max_len - 1 if nn == 'rnn' else args.max_len,
+        compression=args.compression,
+        num_readers=num_threads,
+        num_parallel_calls=num_threads,
+        shuffle_buffer=args.shuffle_buffer,
+        prefetch_buffer=args.prefetch_buffer,
+        bucket_width=args.bucket_width,
+        min_after_dequeue=args.min_after_dequeue,
+    )
+
+def queue_size_op(graph):
+    """ QueueSizeV2 of the shuffle_batch queue, added for its summary """
+    for op in graph.get_operations():
+        if op.type in ['QueueSize', 'QueueSizeV2'] and \
+           op.name.startswith('shuffle_batch'):
+            return op.outputs[0]
+    return None
+
+def run_config(args, nn, num_threads, batch_size):
+    para = reader_para(args, nn, num_threads, batch_size)
+    graph = tf.Graph()
+    with graph.as_default():
+        if nn == 'cnn':
+            batch = SRCNNReader(para).read_batch_sequences(args.mode)
+        else:
+            batch = Multi_Task_Seq2SeqReader(para).read_batch_sequences(
+                args.mode
+            )
+        queue_size = queue_size_op(graph) if nn == 'rnn' else None
+        capacity = para.min_after_dequeue + 3 * batch_size
+
+    config = tf.ConfigProto(
+        intra_op_parallelism_threads=args.intra_op_threads,
+        inter_op_parallelism_threads=args.inter_op_threads
+    )
+    with tf.Session(config=config, graph=graph) as sess:
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+        try:
+            for _ in range(args.warmup):
+                sess.run(batch)
+
+            windows = []
+            total_examples = 0
+            examples, waits, sizes = 0, [], []
+            window_start = time.time()
+            start = window_start
+            for step in range(1, args.num_batches + 1):
+                wait_start = time.time()
+                if queue_size is not None:
+                    outputs, size = sess.run([batch, queue_size])
+                    sizes.append(size)
+                else:
+                    outputs = sess.run(batch)
+                waits.append(time.time() - wait_start)
+                # the true batch size, bucketing may drop examples
+                examples += len(outputs[0])
+                total_examples += len(outputs[0])
+                if args.step_seconds > 0:
+                    time.sleep(args.step_seconds)
+
+                if step % args.report_every == 0 or step == args.num_batches:
+                    seconds = time.time() - window_start
+                    window = {
+                        'batch': step,
+                        'examples_per_sec': examples / seconds,
+                        'batches_per_sec': len(waits) / seconds,
+                        'mean_wait_ms': 1000 * np.mean(waits),
+                        'ready_batches': np.mean(
+                            np.array(waits) < READY_SECONDS
+                        ),
+                    }
+                    if queue_size is not None:
+                        window['queue_size'] = float(np.mean(sizes))
+                        window['queue_fraction'] = \
+                            float(np.mean(sizes)) / capacity
+                    windows.append(window)
+                    print_window(nn, num_threads, batch_size, window)
+                    examples, waits, sizes = 0, [], []
+                    window_start = time.time()
+            seconds = time.time() - start
+        finally:
+            coord.request_stop()
+            coord.join(threads)
+
+    return {
+        'nn': nn,
+        'num_threads': num_threads,
+        'batch_size': batch_size,
+        'seconds': seconds,
+        'batches_per_sec': args.num_batches / seconds,
+        'examples_per_sec': total_examples / seconds,
+        'windows': windows,
+    }
+
+def print_window(nn, num_threads, batch_size, window):
+    line = '{} threads: {:2d} batch_size: {:4d} batch: {:6d} ' \
+           'examples/sec: {:9.1f} batches/sec: {:7.2f} wait: {:7.2f}ms ' \
+           'ready: {:4.0%}'.format(
+               nn, num_threads, batch_size, window['batch'],
+               window['examples_per_sec'], window['batches_per_sec'],
+               window['mean_wait_ms'], window['ready_batches']
+           )
+    if 'queue_size' in window:
+        line += ' queue: {:.0f} ({:.0%})'.format(window['queue_size'],
+                                                  window['queue_fraction'])
+    print(line)
+
+def print_summary(results):
+    print('{:4s} {:>8s} {:>10s} {:>14s} {:>12s}'.format(
+        'nn', 'threads', 'batch_size', 'examples/sec', 'batches/sec'
+    ))
+    for r in results:
+        print('{:4s} {:8d} {:10d} {:14.1f} {:12.2f}'.format(
+            r['nn'], r['num_threads'], r['batch_size'],
+            r['examples_per_sec'], r['batches_per_sec']
+        ))
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nn', type=str, default='cnn,rnn',
+                        help='comma separated readers to run')
+    parser.add_argument('--mode', type=str, default='train',
+                        help='split of the .tfrecords')
+    parser.add_argument('--num_threads', type=int_list, default=[1, 2, 4],
+                        help='comma separated, num_readers and '
+                             'num_parallel_calls of cnn, reader threads of rnn')
+    parser.add_argument('--batch_sizes', type=int_list, default=[32],
+                        help='comma separated')
+    parser.add_argument('--num_batches', type=int, default=200, help='')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='batches read before measuring')
+    parser.add_argument('--report_every', type=int, default=50, help='')
+    parser.add_argument('--step_seconds', type=float, default=0,
+                        help='simulated training step after every batch')
+    parser.add_argument('--max_len', type=int, default=210, help='')
+    parser.add_argument('--compression', type=str, default='none',
+                        choices=['none', 'gzip', 'zlib'], help='')
+    parser.add_argument('--shuffle_buffer', type=int, default=256, help='')
+    parser.add_argument('--prefetch_buffer', type=int, default=2, help='')
+    parser.add_argument('--bucket_width', type=int, default=10, help='')
+    parser.add_argument('--min_after_dequeue', type=int, default=256, help='')
+    parser.add_argument('--intra_op_threads', type=int, default=0,
+                        help='0 lets TensorFlow decide')
+    parser.add_argument('--inter_op_threads', type=int, default=0,
+                        help='0 lets TensorFlow decide')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write the results as JSON')
+    args = parser.parse_args()
+
+    # the readers glob ./data/
+    os.chdir(repo_dir)
+
+    results = []
+    for nn in args.nn.split(','):
+        for num_threads in args.num_threads:
+            for batch_size in args.batch_sizes:
+                results.append(run_config(args, nn, num_threads, batch_size))
+    print_summary(results)
+
+    if args.output is not None:
+        json.dump({'params': {k: v for k, v in vars(args).items()
+                              if k != 'output'},
+                   'results': results},
+                  open(args.output, 'w'), indent=2)
+        print('report: {}'.format(args.output))
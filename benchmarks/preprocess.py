@@ -0,0 +1,280 @@
+""" preprocessing benchmark on synthetic data
+
+    $ python3 benchmarks/preprocess.py --num_playlists 100000
+    $ python3 benchmarks/preprocess.py --compare old.json new.json
+
+    Generates x.txt, y.txt, meta.txt, artist.txt and genre.txt in a temporary
+    copy of the data/ layout and runs every stage of prepare_data.py in its own
+    process, recording wall time and peak RSS. The report is written as JSON,
+    together with the commit it was measured on.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STAGES = ['create_vocabulary_file',
+          'create_playlist_pair_file',
+          'split_playlists',
+          'convert_to_tf_format']
+
+def zipf_sampler(rng, num_songs, exponent):
+    """ song ranks drawn with p(rank) ~ 1 / rank ** exponent """
+    cdf = np.cumsum(1.0 / np.arange(1, num_songs + 1) ** exponent)
+    cdf /= cdf[-1]
+    return lambda size: np.searchsorted(cdf, rng.random_sample(size))
+
+def playlist_lengths(rng, size, mean_len):
+    """ log-normal lengths, most playlists are short with a long tail """
+    lengths = rng.lognormal(np.log(mean_len), 0.6, size)
+    return np.clip(lengths, 2, 500).astype(np.int64)
+
+def write_playlists(file_name, dates, seeds, lengths, sample, song_strs, rng,
+                    none_rate):
+    tokens = song_strs[sample(int(lengths.sum()))]
+    if none_rate > 0:
+        tokens[rng.random_sample(len(tokens)) < none_rate] = 'None'
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    with open(file_name, 'a') as output_file:
+        output_file.write(''.join(
+            '{} {} {}\n'.format(dates[i], seeds[i],
+                                ' '.join(tokens[offsets[i]:offsets[i + 1]]))
+            for i in range(len(lengths))
+        ))
+
+def generate(data_dir, args):
+    """
+        data/raw/x.txt, data/raw/y.txt: 'date seed song ...' per line, songs
+        follow a Zipf distribution and ~10% of the playlists have no pair
+        data/meta.txt: 'song artist genre', data/artist.txt, data/genre.txt
+    """
+    rng = np.random.RandomState(args.seed)
+    raw_dir = os.path.join(data_dir, 'raw')
+    os.makedirs(raw_dir)
+
+    song_ids = rng.permutation(args.num_songs) + 100000
+    song_strs = song_ids.astype(str).astype(object)
+    sample = zipf_sampler(rng, args.num_songs, args.zipf)
+
+    num_days = max(args.num_playlists // 10000, 30)
+    for start in range(0, args.num_playlists, args.chunk_size):
+        size = min(args.chunk_size, args.num_playlists - start)
+        dates = (20170101 + rng.randint(0, num_days, size)).astype(str)
+        seeds = song_strs[sample(size)]
+        write_playlists(os.path.join(raw_dir, 'x.txt'), dates, seeds,
+                        playlist_lengths(rng, size, args.mean_len), sample,
+                        song_strs, rng, 0.01)
+        paired = rng.random_sample(size) < 0.9
+        write_playlists(os.path.join(raw_dir, 'y.txt'), dates[paired],
+                        seeds[paired],
+                        playlist_lengths(rng, int(paired.sum()), args.mean_len),
+                        sample, song_strs, rng, 0.0)
+
+    num_artists = max(args.num_songs // 10, 1)
+    num_genres = 200
+    artists = zipf_sampler(rng, num_artists, 1.0)(args.num_songs)
+    genres = rng.randint(0, num_genres, args.num_songs)
+    with open(os.path.join(data_dir, 'meta.txt'), 'w') as output_file:
+        output_file.write('0 0 0\n')
+        output_file.write(''.join(
+            '{} {} {}\n'.format(song_ids[i], artists[i], genres[i])
+            for i in range(args.num_songs)
+        ))
+    with open(os.path.join(data_dir, 'artist.txt'), 'w') as output_file:
+        output_file.write('\n'.join(str(i) for i in range(num_artists)))
+    with open(os.path.join(data_dir, 'genre.txt'), 'w') as output_file:
+        output_file.write('\n'.join(str(i) for i in range(num_genres)))
+
+def peak_rss_mb():
+    """
+        ru_maxrss keeps the peak of the process that exec'ed us, VmHWM is
+        reset by exec, so it only covers this process
+    """
+    try:
+        with open('/proc/self/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # KB on linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024
+
+def run_stage(stage, data_dir, args):
+    """ runs in its own process, so ru_maxrss is the peak of this stage """
+    sys.path.insert(0, repo_dir)
+    sys.path.insert(0, os.path.join(repo_dir, 'data'))
+    sys.path.insert(0, os.path.join(repo_dir, 'data', 'raw'))
+
+    if stage == 'convert_to_tf_format':
+        os.chdir(data_dir)
+        from tf_format import convert_to_tf_format
+        for mode in ['train', 'valid']:
+            convert_to_tf_format(mode, num_shards=args.num_shards,
+                                 workers=args.workers)
+    else:
+        os.chdir(os.path.join(data_dir, 'raw'))
+        import prepare_raw_data
+        import prepare_ids_data
+        if stage == 'create_vocabulary_file':
+            prepare_raw_data.create_vocabulary_file(args.vocab_size)
+        elif stage == 'create_playlist_pair_file':
+            prepare_raw_data.create_playlist_pair_file()
+        elif stage == 'split_playlists':
+            vocab_dct = prepare_ids_data.create_vocabulary_file()
+            prepare_ids_data.split_playlists(vocab_dct, args.workers)
+
+def measure_stage(stage, data_dir, args, log_file):
+    result_file_name = os.path.join(data_dir, '..', stage + '.json')
+    cmd = [sys.executable, os.path.abspath(__file__), '--run_stage', stage,
+           '--data_dir', data_dir, '--result', result_file_name,
+           '--vocab_size', str(args.vocab_size),
+           '--workers', str(args.workers),
+           '--num_shards', str(args.num_shards)]
+    start = time.time()
+    proc = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+    seconds = time.time() - start
+    if proc.returncode != 0 or not os.path.exists(result_file_name):
+        return {'stage': stage, 'seconds': seconds, 'failed': True}
+    result = json.load(open(result_file_name, 'r'))
+    result['stage'] = stage
+    return result
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+            stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='preprocess_benchmark_',
+                                dir=args.tmp_dir)
+    data_dir = os.path.join(work_dir, 'data')
+    try:
+        start = time.time()
+        generate(data_dir, args)
+        generate_seconds = time.time() - start
+        input_bytes = directory_size(data_dir)
+        print('generated {} playlists in {:.1f}s ({:.1f} MB)'.format(
+            args.num_playlists, generate_seconds, input_bytes / 2 ** 20
+        ))
+
+        stages = []
+        log_file = open(os.path.join(work_dir, 'stages.log'), 'w')
+        for stage in args.stages.split(','):
+            result = measure_stage(stage, data_dir, args, log_file)
+            stages.append(result)
+            if result.get('failed'):
+                log_file.close()
+                shutil.copy(log_file.name, args.output + '.log')
+                print('{}: failed, see {}'.format(stage, args.output + '.log'))
+                break
+            print('{}: {:.2f}s, peak rss {:.1f} MB'.format(
+                stage, result['seconds'], result['max_rss_mb']
+            ))
+        log_file.close()
+
+        report = {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'params': {k: v for k, v in vars(args).items()
+                       if k not in ['output', 'tmp_dir', 'run_stage',
+                                    'data_dir', 'result', 'compare']},
+            'generate_seconds': generate_seconds,
+            'input_mb': input_bytes / 2 ** 20,
+            'output_mb': (directory_size(data_dir) - input_bytes) / 2 ** 20,
+            'stages': stages,
+        }
+    finally:
+        shutil.rmtree(work_dir)
+    json.dump(report, open(args.output, 'w'), indent=2)
+    print('report: {}'.format(args.output))
+
+def compare(file_names):
+    """ seconds and peak rss of every stage against the first report """
+    reports = [json.load(open(file_name, 'r')) for file_name in file_names]
+    base = {s['stage']: s for s in reports[0]['stages']}
+    for file_name, report in zip(file_names, reports):
+        print('{} ({})'.format(file_name, report['commit'][:10]))
+        for s in report['stages']:
+            if s.get('failed'):
+                print('  {:28s} failed'.format(s['stage']))
+                continue
+            line = '  {:28s} {:9.2f}s {:9.1f} MB'.format(
+                s['stage'], s['seconds'], s['max_rss_mb']
+            )
+            b = base.get(s['stage'])
+            if b is not None and not b.get('failed') and b['seconds'] > 0:
+                line += '  x{:.2f} time, x{:.2f} rss'.format(
+                    s['seconds'] / b['seconds'],
+                    s['max_rss_mb'] / max(b['max_rss_mb'], 1e-6)
+                )
+            print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_playlists', type=int, default=10000,
+                        help='10k to 10M')
+    parser.add_argument('--num_songs', type=int, default=200000, help='')
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help='exponent of the song popularity')
+    parser.add_argument('--mean_len', type=float, default=60, help='')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    parser.add_argument('--chunk_size', type=int, default=100000, help='')
+    parser.add_argument('--vocab_size', type=int, default=70000, help='')
+    parser.add_argument('--workers', type=int, default=1, help='')
+    parser.add_argument('--num_shards', type=int, default=16, help='')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES),
+                        help='comma separated stages to run, in order')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='')
+    parser.add_argument('--output', type=str,
+                        default='preprocess_benchmark.json', help='')
+    parser.add_argument('--compare', type=str, nargs='+', default=None,
+                        help='print reports next to each other')
+    # used by the stage processes
+    parser.add_argument('--run_stage', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--data_dir', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.compare)
+    elif args.run_stage is not None:
+        start_rss = peak_rss_mb()
+        start = time.time()
+        run_stage(args.run_stage, args.data_dir, args)
+        seconds = time.time() - start
+        # the peak of the largest worker process is reported on its own
+        json.dump({
+            'seconds': seconds,
+            'start_rss_mb': start_rss,
+            'max_rss_mb': peak_rss_mb(),
+            'max_child_rss_mb': resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        }, open(args.result, 'w'))
+    else:
+        benchmark(args)
@@ -1,141 +1,174 @@
-from collections import defaultdict
+import argparse
+import os
+import sys
+import threading
+from array import array
+from collections import defaultdict, deque
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from lib.dataset import ArrayWriter, CSRWriter
+
+WRITE_BUFFER_SIZE = 1 << 20
 
 def create_vocabulary_file():
     vocab_list = open('../vocab_default.txt', 'r').read().splitlines()
     dct = defaultdict(lambda : 3, [[word, i] for i, word in enumerate(vocab_list)])
     return dct
 
-def parse_train_or_valid_flag():
-    raw_file = open('./raw_data.txt', 'r').read().splitlines()
-    raw_file = [seq.split(' ') for seq in raw_file]
-    raw_file = [seq[:2] for seq in raw_file]
-
-    train_or_valid_flag = []
-    dct = {}
-    for i, seq in enumerate(raw_file):
-        if seq[1] in dct:
-            dct[seq[1]].append(seq[0])
-            train_or_valid_flag.append(0)
-        else:
-            dct[seq[1]] = [seq[0]]
-            train_or_valid_flag.append(1)
-    return train_or_valid_flag
-
-def song_id_to_vocab_id(file_name, train_or_valid_flag, vocab_dct):
-    input_file = open(file_name, 'r').read().splitlines()
-    seqs = [seq.split(' ') for seq in input_file]
-    seqs = [seq[2:] for seq in seqs]
-
-    # song ids file
-    output_train_file_name = '../train_' + file_name
-    output_train_file = open(output_train_file_name, 'w')
-    output_valid_file_name = '../valid_' + file_name
-    output_valid_file = open(output_valid_file_name, 'w')
-    output_test_file_name = '../test_' + file_name
-    output_test_file = open(output_test_file_name, 'w')
-    counter = 0
-    for i, seq in enumerate(seqs):
-        if counter < 32:
-            output_test_file.write(' '.join(seq) + '\n')
-            counter += 1
-        elif train_or_valid_flag[i] == 1: # valid
-            output_valid_file.write(' '.join(seq) + '\n')
-        else: # train
-            output_train_file.write(' '.join(seq) + '\n')
-    output_train_file.close()
-    output_valid_file.close()
-    output_test_file.close()
-
-    # song id to vocab id
-    seqs = [[str(vocab_dct[word]) for word in seq] for seq in seqs]
-
-    # vocab ids file
-    output_train_file_name = '../train_ids_' + file_name
-    output_train_file = open(output_train_file_name, 'w')
-    output_valid_file_name = '../valid_ids_' + file_name
-    output_valid_file = open(output_valid_file_name, 'w')
-    output_test_file_name = '../test_ids_' + file_name
-    output_test_file = open(output_test_file_name, 'w')
-    counter = 0
-    for i, seq in enumerate(seqs):
-        if counter < 32:
-            output_test_file.write(' '.join(seq) + '\n')
-            counter += 1
-        elif train_or_valid_flag[i] == 1: # valid
-            output_valid_file.write(' '.join(seq) + '\n')
-        else: # train
-            output_train_file.write(' '.join(seq) + '\n')
-    output_train_file.close()
-    output_valid_file.close()
-    output_test_file.close()
-
-def create_vocab_id_seed_file(train_or_valid_flag, vocab_dct):
-    raw_file = open('./raw_data.txt', 'r').read().splitlines()
-    seqs = [seq.split(' ') for seq in raw_file]
-    seqs = [seq[1] for seq in seqs]
-
-    # song ids file
-    train_seed_file = open('../train_seed.txt', 'w')
-    valid_seed_file = open('../valid_seed.txt', 'w')
-    test_seed_file = open('../test_seed.txt', 'w')
-    counter = 0
-    for i, seq in enumerate(seqs):
-        if counter < 32:
-            test_seed_file.write(seq + '\n')
-            counter += 1
-        elif train_or_valid_flag[i] == 1:
-            valid_seed_file.write(seq + '\n')
-        else:
-            train_seed_file.write(seq + '\n')
-    train_seed_file.close()
-    valid_seed_file.close()
-    test_seed_file.close()
-
-    # song id to vocab id
-    seqs = [str(vocab_dct[word]) for word in seqs]
-
-    # vocab ids file
-    train_seed_file = open('../train_ids_seed.txt', 'w')
-    valid_seed_file = open('../valid_ids_seed.txt', 'w')
-    test_seed_file = open('../test_ids_seed.txt', 'w')
-    counter = 0
-    for i, seq in enumerate(seqs):
-        if counter < 32:
-            test_seed_file.write(seq + '\n')
-            counter += 1
-        elif train_or_valid_flag[i] == 1:
-            valid_seed_file.write(seq + '\n')
-        else:
-            train_seed_file.write(seq + '\n')
-    train_seed_file.close()
-    valid_seed_file.close()
-    test_seed_file.close()
-
-def cal_dedup_id_not_found_rate():
-    input_file = open('../train_ids_rerank_data.txt', 'r').read().splitlines()
-    seqs = [seq.split(' ') for seq in input_file]
-    input_file = open('../valid_ids_rerank_data.txt', 'r').read().splitlines()
-    input_file = [seq.split(' ') for seq in input_file]
-    input_file.extend(seqs)
-
-    # check how many songs are not in raw playlists
-    counter = 0
+def open_split_files(append=False):
+    """ song ids and vocab ids output files of every split """
+    files = {}
+    file_mode = 'a' if append else 'w'
+    for split in ['train', 'valid', 'test']:
+        for name in ['raw_data', 'rerank_data', 'seed']:
+            files[split, name] = open(
+                '../{}_{}.txt'.format(split, name), file_mode,
+                buffering=WRITE_BUFFER_SIZE
+            )
+            files[split, 'ids_' + name] = open(
+                '../{}_ids_{}.txt'.format(split, name), file_mode,
+                buffering=WRITE_BUFFER_SIZE
+            )
+        # binary copies of the vocab ids files, see lib/dataset.py
+        for name in ['raw_data', 'rerank_data']:
+            files[split, 'csr_' + name] = CSRWriter(
+                '../{}_ids_{}'.format(split, name), append
+            )
+        files[split, 'npy_seed'] = ArrayWriter(
+            '../{}_ids_seed.npy'.format(split), append=append
+        )
+    return files
+
+def read_pairs(chunk_size, input_file_names):
+    """ read raw_data.txt and rerank_data.txt together in chunks of
+        (seed, raw song ids, rerank song ids) """
+    chunk = []
+    with open(input_file_names[0], 'r') as raw_file, \
+         open(input_file_names[1], 'r') as rerank_file:
+        for raw_line, rerank_line in zip(raw_file, rerank_file):
+            raw_seq = raw_line.rstrip('\n').split(' ', 2)
+            rerank_seq = rerank_line.rstrip('\n').split(' ', 2)
+            chunk.append((
+                raw_seq[1],
+                raw_seq[2] if len(raw_seq) > 2 else '',
+                rerank_seq[2] if len(rerank_seq) > 2 else ''
+            ))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def map_chunk(chunk, vocab_dct):
+    """ song id to vocab id, both as text and as an int32 array """
+    def to_ids(seq):
+        if len(seq) == 0:
+            return '', array('i')
+        ids = [vocab_dct.get(word, 3) for word in seq.split(' ')]
+        return ' '.join([str(i) for i in ids]), array('i', ids)
+
+    return [(vocab_dct.get(seed, 3), to_ids(raw_seq), to_ids(rerank_seq))
+            for seed, raw_seq, rerank_seq in chunk]
+
+_worker_vocab_dct = None
+
+def init_worker(vocab_dct):
+    global _worker_vocab_dct
+    _worker_vocab_dct = vocab_dct
+
+def map_chunk_worker(chunk):
+    return map_chunk(chunk, _worker_vocab_dct)
+
+def split_playlists(vocab_dct, workers=1, chunk_size=10000,
+                    input_file_names=('./raw_data.txt', './rerank_data.txt'),
+                    append=False, seen_seeds=None, num_lines=0):
+    """
+        Write all train / valid / test files in one pass over the paired
+        raw_data.txt and rerank_data.txt.
+
+        The first 32 playlists are for testing. After that a playlist is
+        for validation if its seed song has not been seen before and for
+        training otherwise.
+
+        To continue an earlier split, pass append=True together with the
+        seeds it has seen and the number of playlists it has written.
+        Returns the updated (seen_seeds, num_lines) and the number of
+        playlists written to every split by this call.
+    """
+    vocab_dct = dict(vocab_dct)
+    files = open_split_files(append)
+    if seen_seeds is None:
+        seen_seeds = set()
+    split_lines = {'train': 0, 'valid': 0, 'test': 0}
     not_found = 0
-    for i in range(len(input_file)):
-        for j in range(len(input_file[i])):
-            if input_file[i][j] == '3':
-                # print("{}-th row: {}-th".format(i, j))
-                not_found += 1
-            counter += 1
-    print('dedup not found rate: {}%'.format(not_found / counter * 100))
+    counter = 0
 
-if __name__ == '__main__':
-    vocab_dct = create_vocabulary_file()
-    # 0 for training, 1 for validation
-    train_or_valid_flag = parse_train_or_valid_flag()
-    song_id_to_vocab_id('raw_data.txt', train_or_valid_flag, vocab_dct)
-    song_id_to_vocab_id('rerank_data.txt', train_or_valid_flag, vocab_dct)
+    if workers > 1:
+        # chunks stay in this process, workers only send back the vocab ids.
+        # The task feeder of the pool drains dispatch() as fast as it can,
+        # so at most 2 * workers chunks are read ahead of the writer.
+        chunks = deque()
+        in_flight = threading.Semaphore(2 * workers)
+        def dispatch():
+            for chunk in read_pairs(chunk_size, input_file_names):
+                in_flight.acquire()
+                chunks.append(chunk)
+                yield chunk
+        pool = Pool(workers, initializer=init_worker, initargs=(vocab_dct,))
+        mapped_chunks = ((chunks.popleft(), mapped_chunk) for mapped_chunk in
+                         pool.imap(map_chunk_worker, dispatch()))
+    else:
+        pool = None
+        in_flight = None
+        mapped_chunks = ((chunk, map_chunk(chunk, vocab_dct))
+                         for chunk in read_pairs(chunk_size, input_file_names))
+
+    for chunk, mapped_chunk in mapped_chunks:
+        for (seed, raw_seq, rerank_seq), \
+            (seed_id, (raw_ids, raw_array), (rerank_ids, rerank_array)) in \
+                zip(chunk, mapped_chunk):
+            if num_lines < 32:
+                split = 'test'
+            elif seed not in seen_seeds: # valid
+                split = 'valid'
+            else: # train
+                split = 'train'
+            seen_seeds.add(seed)
+            num_lines += 1
+            split_lines[split] += 1
+
+            files[split, 'raw_data'].write(raw_seq + '\n')
+            files[split, 'rerank_data'].write(rerank_seq + '\n')
+            files[split, 'seed'].write(seed + '\n')
+            files[split, 'ids_raw_data'].write(raw_ids + '\n')
+            files[split, 'ids_rerank_data'].write(rerank_ids + '\n')
+            files[split, 'ids_seed'].write(str(seed_id) + '\n')
+            files[split, 'csr_raw_data'].write(raw_array)
+            files[split, 'csr_rerank_data'].write(rerank_array)
+            files[split, 'npy_seed'].write([seed_id])
+
+            # check how many songs are not in raw playlists
+            if split != 'test':
+                not_found += rerank_array.count(3)
+                counter += len(rerank_array)
+        if in_flight is not None:
+            in_flight.release()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for f in files.values():
+        f.close()
+    if counter > 0:
+        print('dedup not found rate: {}%'.format(not_found / counter * 100))
+    return seen_seeds, num_lines, split_lines
 
-    create_vocab_id_seed_file(train_or_valid_flag, vocab_dct)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to map song ids')
+    args = parser.parse_args()
 
-    cal_dedup_id_not_found_rate()
+    vocab_dct = create_vocabulary_file()
+    split_playlists(vocab_dct, args.workers)
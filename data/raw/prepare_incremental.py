@@ -0,0 +1,183 @@
+""" incremental data preparation for daily appended x.txt / y.txt """
+
+import argparse
+import heapq
+import json
+import os
+from collections import Counter
+
+from prepare_raw_data import create_vocabulary_file, create_playlist_pair_file
+from prepare_raw_data import read_lines
+from prepare_ids_data import split_playlists
+import prepare_ids_data
+
+manifest_path = './manifest.json'
+vocab_counts_path = './vocab_counts.txt'
+seen_seeds_path = './seen_seeds.txt'
+
+_START_VOCAB = ['_PAD', '_BOS', '_EOS', '_UNK']
+
+def load_state():
+    """
+        manifest.json: {
+            generation: bumped on every full rebuild,
+            x_offset, y_offset: bytes of x.txt / y.txt already processed,
+            max_date: newest date_of_created_playlist of every line of
+                x.txt / y.txt read, paired or not,
+            num_lines: number of pairs split so far,
+            split_lines: number of pairs in every split,
+        }
+    """
+    if not os.path.exists(manifest_path):
+        return None
+    manifest = json.load(open(manifest_path, 'r'))
+
+    counter = Counter()
+    for line in read_lines(vocab_counts_path):
+        word, count = line.split(' ')
+        counter[word] = int(count)
+    seen_seeds = set(read_lines(seen_seeds_path))
+    return manifest, counter, seen_seeds
+
+def save_state(manifest, counter, seen_seeds):
+    output_file = open(vocab_counts_path, 'w')
+    for word, count in counter.items():
+        output_file.write('{} {}\n'.format(word, count))
+    output_file.close()
+
+    output_file = open(seen_seeds_path, 'w')
+    for seed in seen_seeds:
+        output_file.write(seed + '\n')
+    output_file.close()
+
+    # the manifest goes last, it marks the state as complete
+    json.dump(manifest, open(manifest_path + '.tmp', 'w'))
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def full_rebuild(args, generation):
+    print('full rebuild')
+    x_offset = os.path.getsize('./x.txt')
+    y_offset = os.path.getsize('./y.txt')
+
+    counter = create_vocabulary_file(args.vocab_size)
+    max_date = create_playlist_pair_file(args.num_buckets)
+    vocab_dct = prepare_ids_data.create_vocabulary_file()
+    seen_seeds, num_lines, split_lines = split_playlists(vocab_dct,
+                                                         args.workers)
+
+    manifest = {
+        'generation': generation,
+        'x_offset': x_offset,
+        'y_offset': y_offset,
+        'max_date': max_date,
+        'num_lines': num_lines,
+        'split_lines': split_lines,
+    }
+    save_state(manifest, counter, seen_seeds)
+
+def scan_tail(offsets):
+    """ count song ids, find the oldest and newest dates of appended lines """
+    counter = Counter()
+    min_date = None
+    max_date = ''
+    for file_name, offset in zip(['./x.txt', './y.txt'], offsets):
+        for line in read_lines(file_name, offset):
+            seq = line.split(' ')
+            counter.update(word for word in seq[1:] if word != 'None')
+            if min_date is None or seq[0] < min_date:
+                min_date = seq[0]
+            max_date = max(max_date, seq[0])
+    return counter, min_date, max_date
+
+def vocab_change_rate(counter, vocab_size):
+    vocab_list = open('../vocab_default.txt', 'r').read().splitlines()
+    vocab = set(vocab_list[len(_START_VOCAB):])
+    new_vocab = heapq.nlargest(vocab_size - len(_START_VOCAB), counter.items(),
+                               key=lambda t: t[::-1])
+    changed = sum(1 for word, _ in new_vocab if word not in vocab)
+    return changed / max(len(new_vocab), 1)
+
+def incremental_update(args):
+    state = load_state()
+    if state is None:
+        full_rebuild(args, 0)
+        return
+    manifest, counter, seen_seeds = state
+    generation = manifest['generation']
+    if 'max_date' not in manifest:
+        # older manifests only kept the newest paired date
+        full_rebuild(args, generation + 1)
+        return
+
+    offsets = (manifest['x_offset'], manifest['y_offset'])
+    sizes = (os.path.getsize('./x.txt'), os.path.getsize('./y.txt'))
+    if sizes[0] < offsets[0] or sizes[1] < offsets[1]:
+        print('x.txt or y.txt was rewritten')
+        full_rebuild(args, generation + 1)
+        return
+    if sizes == offsets:
+        print('nothing to update')
+        return
+
+    tail_counter, min_date, tail_max_date = scan_tail(offsets)
+    if min_date is not None and min_date <= manifest['max_date']:
+        # the tail is only paired with itself, a playlist of an old date
+        # could belong to a line which was already read but not paired
+        print('appended playlists are not newer than {}'.format(
+            manifest['max_date']
+        ))
+        full_rebuild(args, generation + 1)
+        return
+    counter.update(tail_counter)
+    change_rate = vocab_change_rate(counter, args.vocab_size)
+    print('vocab change rate: {}%'.format(change_rate * 100))
+    if change_rate > args.rebuild_threshold:
+        full_rebuild(args, generation + 1)
+        return
+
+    tail_file_names = ('./raw_data_tail.txt', './rerank_data_tail.txt')
+    create_playlist_pair_file(args.num_buckets, offsets=offsets,
+                              output_file_names=tail_file_names)
+    vocab_dct = prepare_ids_data.create_vocabulary_file()
+    seen_seeds, num_lines, split_lines = split_playlists(
+        vocab_dct, args.workers, input_file_names=tail_file_names,
+        append=True, seen_seeds=seen_seeds, num_lines=manifest['num_lines']
+    )
+
+    # keep raw_data.txt / rerank_data.txt covering everything processed
+    for tail_file_name, file_name in zip(tail_file_names,
+                                         ['./raw_data.txt', './rerank_data.txt']):
+        with open(tail_file_name, 'r') as tail_file, \
+             open(file_name, 'a') as output_file:
+            for line in tail_file:
+                output_file.write(line)
+        os.remove(tail_file_name)
+
+    print('new data: train {}, valid {}, test {}'.format(
+        split_lines['train'], split_lines['valid'], split_lines['test']
+    ))
+    manifest['x_offset'], manifest['y_offset'] = sizes
+    manifest['max_date'] = max(manifest['max_date'], tail_max_date)
+    manifest['num_lines'] = num_lines
+    for split, num in split_lines.items():
+        manifest['split_lines'][split] += num
+    save_state(manifest, counter, seen_seeds)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_size', type=int, default=70000, help='')
+    parser.add_argument('--rebuild_threshold', type=float, default=0.01,
+                        help='rebuild everything when more than this fraction '
+                             'of the vocab would change')
+    parser.add_argument('--workers', type=int, default=1, help='')
+    parser.add_argument('--num_buckets', type=int, default=0,
+                        help='see prepare_raw_data.py')
+    parser.add_argument('--full', type=int, default=0,
+                        help='force a full rebuild')
+    args = parser.parse_args()
+
+    if args.full == 1:
+        state = load_state()
+        full_rebuild(args, 0 if state is None else state[0]['generation'] + 1)
+    else:
+        incremental_update(args)
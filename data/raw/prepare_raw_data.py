@@ -1,83 +1,185 @@
-from collections import defaultdict
+import argparse
+import heapq
+import os
+import resource
+import shutil
+import tempfile
+import zlib
+from collections import Counter
 
-def create_vocabulary_file():
-    vocab_size = 70000
+# when --num_buckets is not given, every bucket gets about this many bytes of
+# x.txt and y.txt, it is what has to fit in memory while joining a bucket
+BUCKET_BYTES = 1 << 26
+MIN_NUM_BUCKETS = 128
 
+def read_lines(file_name, offset=0):
+    with open(file_name, 'r') as input_file:
+        input_file.seek(offset)
+        for line in input_file:
+            yield line.rstrip('\r\n')
+
+def count_song_ids(file_names):
+    # only one line is held at a time, the counter grows with distinct ids
+    counter = Counter()
+    for file_name in file_names:
+        for line in read_lines(file_name):
+            seq = line.split(' ')[1:]
+            counter.update(word for word in seq if word != 'None')
+    return counter
+
+def create_vocabulary_file(vocab_size=70000):
     _START_VOCAB = ['_PAD', '_BOS', '_EOS', '_UNK']
 
-    raw_file = open('./x.txt', 'r').read().splitlines()
-    raw_seqs = [seq.split(' ') for seq in raw_file]
-    raw_seqs = [seq[1:] for seq in raw_seqs]
-    raw_seqs = [[word for word in seq if word != 'None'] for seq in raw_seqs]
-    rerank_file = open('./y.txt', 'r').read().splitlines()
-    rerank_seqs = [seq.split(' ') for seq in rerank_file]
-    rerank_seqs = [seq[1:] for seq in rerank_seqs]
-    rerank_seqs = [[word for word in seq if word != 'None'] for seq in rerank_seqs]
-    raw_seqs.extend(rerank_seqs)
-    vocab = {}
-    for seq in raw_seqs:
-        for word in seq:
-            if word in vocab:
-                vocab[word] += 1
-            else:
-                vocab[word] = 1
-    vocab_list = sorted(vocab.items(), key=lambda t: t[::-1], reverse=True)
-    vocab_list = [vocab_list[i][0] for i in range(vocab_size - 4)]
-    vocab_list = _START_VOCAB + vocab_list
-    if len(vocab_list) > vocab_size:
-        vocab_list = vocab_list[:vocab_size]
+    counter = count_song_ids(['./x.txt', './y.txt'])
+    # same order as sorting by (count, song_id) in reverse, without the full sort
+    vocab_list = heapq.nlargest(vocab_size - len(_START_VOCAB), counter.items(),
+                                key=lambda t: t[::-1])
+    vocab_list = _START_VOCAB + [word for word, _ in vocab_list]
     print('vocab size: {}'.format(len(vocab_list)))
 
     output_file = open('../vocab_default.txt', 'w')
     output_file.write('\n'.join(vocab_list))
     output_file.close()
+    return counter
 
-def create_playlist_pair_file():
-    vocab_list = open('../vocab_default.txt', 'r').read().splitlines()
-    vocab = defaultdict(lambda: -1, [[word, 1] for i, word in enumerate(vocab_list)])
-
-    def read_file(file_name):
-        input_file = open(file_name, 'r').read().splitlines()
-        input_file = [seq.split(' ') for seq in input_file]
-        input_file = [[seq[i] for i in range(len(seq))
-                    if (seq[i] in vocab or i == 0 or i == 1) and seq[i] != 'None']
-                    for seq in input_file if seq[1] in vocab]
-        return input_file
+def partition_playlists(file_name, vocab, bucket_files, offset=0):
+    """ write every usable playlist as 'date seed<TAB>playlist' into the
+        bucket chosen by a hash of its (date, seed) key, returns the number
+        of lines and the newest date of all of them, paired or not """
+    num_lines = 0
+    max_date = ''
+    for line in read_lines(file_name, offset):
+        num_lines += 1
+        seq = line.split(' ')
+        max_date = max(max_date, seq[0])
+        if len(seq) < 2 or seq[1] not in vocab:
+            continue
+        seq = [seq[i] for i in range(len(seq))
+               if (seq[i] in vocab or i == 0 or i == 1) and seq[i] != 'None']
+        key = seq[0] + ' ' + seq[1]
+        bucket = zlib.crc32(key.encode('utf-8')) % len(bucket_files)
+        bucket_files[bucket].write(key + '\t' + ' '.join(seq) + '\n')
+    return num_lines, max_date
 
-    raw_file = read_file('./x.txt')
-    rerank_file = read_file('./y.txt')
+def join_bucket(raw_file_name, rerank_file_name, run_file_name):
+    """ join one bucket in memory and write it as a reverse-sorted run """
+    def read_bucket(file_name):
+        # later playlists with the same key overwrite earlier ones
+        dct = {}
+        for line in read_lines(file_name):
+            key, seq = line.split('\t', 1)
+            dct[key] = seq
+        return dct
 
-    raw_dct = {}
-    rerank_dct = {}
-    for i, seq in enumerate(raw_file):
-        key = seq[0] + ' ' + seq[1]
-        raw_dct[key] = i
-    for i, seq in enumerate(rerank_file):
-        key = seq[0] + ' ' + seq[1]
-        rerank_dct[key] = i
-
-    x_file = open('./raw_data.txt', 'w')
-    y_file = open('./rerank_data.txt', 'w')
-    counter = 0
-    total_num = len(open('./x.txt', 'r').read().splitlines())
-    chosen_ids = []
-    for k, v in raw_dct.items():
-        if k in rerank_dct and k in raw_dct:
-            j = rerank_dct[k]
-            if len(rerank_file[j]) < 32:
-                continue
-            chosen_ids.append(k)
-            counter += 1
+    raw_dct = read_bucket(raw_file_name)
+    rerank_dct = read_bucket(rerank_file_name)
+    chosen_ids = [k for k in raw_dct
+                  if k in rerank_dct and rerank_dct[k].count(' ') + 1 >= 32]
     chosen_ids = sorted(chosen_ids, reverse=True)
+
+    run_file = open(run_file_name, 'w')
     for k in chosen_ids:
-            i = raw_dct[k]
-            j = rerank_dct[k]
-            x_file.write(' '.join(raw_file[i]) + '\n')
-            y_file.write(' '.join(rerank_file[j]) + '\n')
-    x_file.close()
-    y_file.close()
-    print('used data: {} / {} = {}%'.format(counter, total_num, counter / total_num * 100))
+        run_file.write(k + '\t' + raw_dct[k] + '\t' + rerank_dct[k] + '\n')
+    run_file.close()
+    return len(chosen_ids)
+
+def default_num_buckets(offsets=(0, 0)):
+    """ number of buckets for BUCKET_BYTES of input each """
+    size = sum(os.path.getsize(file_name) - offset
+               for file_name, offset in zip(['./x.txt', './y.txt'], offsets))
+    return max(MIN_NUM_BUCKETS, -(-size // BUCKET_BYTES))
+
+def reserve_open_files(num_files):
+    """ raise the soft limit of open files, every bucket is one file """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # stdin, stdout, the input file, ...
+    needed = num_files + 64
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    if hard != resource.RLIM_INFINITY and hard < needed:
+        raise ValueError(
+            '{} buckets need {} open files, the limit is {}, '
+            'pass a smaller --num_buckets'.format(num_files, needed, hard)
+        )
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+def create_playlist_pair_file(num_buckets=0, tmp_dir='.', offsets=(0, 0),
+                              output_file_names=('./raw_data.txt',
+                                                 './rerank_data.txt')):
+    """
+        Pair x.txt with y.txt by (date, seed) as an external hash join, so
+        only one bucket has to fit in memory at a time.
+
+        1. partition both files into on-disk buckets by hash of the key
+        2. join every bucket on its own into a reverse-sorted run
+        3. k-way merge all runs into raw_data.txt and rerank_data.txt
+
+        offsets are byte offsets into x.txt and y.txt to start reading from.
+        num_buckets <= 0 derives it from the size of what is read.
+        Returns the newest date of every line read.
+    """
+    if num_buckets <= 0:
+        num_buckets = default_num_buckets(offsets)
+    print('buckets: {}'.format(num_buckets))
+    reserve_open_files(num_buckets)
+    vocab = set(open('../vocab_default.txt', 'r').read().splitlines())
+    work_dir = tempfile.mkdtemp(prefix='pair_', dir=tmp_dir)
+    try:
+        total_num = 0
+        max_date = ''
+        for name, file_name, offset in [('raw', './x.txt', offsets[0]),
+                                        ('rerank', './y.txt', offsets[1])]:
+            bucket_files = [
+                open(os.path.join(work_dir, '{}_{}.txt'.format(name, i)), 'w')
+                for i in range(num_buckets)
+            ]
+            num_lines, file_max_date = partition_playlists(
+                file_name, vocab, bucket_files, offset
+            )
+            max_date = max(max_date, file_max_date)
+            if name == 'raw':
+                total_num = num_lines
+            for bucket_file in bucket_files:
+                bucket_file.close()
+
+        counter = 0
+        run_file_names = []
+        for i in range(num_buckets):
+            run_file_name = os.path.join(work_dir, 'run_{}.txt'.format(i))
+            counter += join_bucket(
+                os.path.join(work_dir, 'raw_{}.txt'.format(i)),
+                os.path.join(work_dir, 'rerank_{}.txt'.format(i)),
+                run_file_name
+            )
+            run_file_names.append(run_file_name)
+
+        # keys are unique across runs since equal keys share a bucket
+        runs = [read_lines(file_name) for file_name in run_file_names]
+        x_file = open(output_file_names[0], 'w')
+        y_file = open(output_file_names[1], 'w')
+        for line in heapq.merge(*runs, key=lambda line: line.split('\t', 1)[0],
+                                reverse=True):
+            _, raw_seq, rerank_seq = line.split('\t')
+            x_file.write(raw_seq + '\n')
+            y_file.write(rerank_seq + '\n')
+        x_file.close()
+        y_file.close()
+    finally:
+        shutil.rmtree(work_dir)
+    if total_num > 0:
+        print('used data: {} / {} = {}%'.format(counter, total_num, counter / total_num * 100))
+    return max_date
 
 if __name__ == '__main__':
-    create_vocabulary_file()
-    create_playlist_pair_file()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_size', type=int, default=70000, help='')
+    parser.add_argument('--num_buckets', type=int, default=0,
+                        help='buckets of the join of x.txt and y.txt, '
+                             '0 gives every bucket about 64MB of input')
+    args = parser.parse_args()
+
+    # a full run invalidates the state of incremental runs
+    if os.path.exists('./manifest.json'):
+        os.remove('./manifest.json')
+    create_vocabulary_file(args.vocab_size)
+    create_playlist_pair_file(args.num_buckets)
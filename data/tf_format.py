@@ -0,0 +1,223 @@
+""" convert input data to Standard Tensorflow Format
+
+    Every line of {mode}_ids_raw_data / {mode}_ids_rerank_data / {mode}_ids_seed
+    is parsed once and written as a cnn example (with artist and genre
+    features) and as an rnn example (framed by _BOS and _EOS).
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.dataset import load_array, load_csr, load_meta_table
+from lib.utils import tfrecord_options
+
+max_len = 210
+
+def _int64_feature(value):
+  return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+def _list_feature(lst):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=lst))
+
+def converted_lines(output_file_name):
+    """
+        Number of lines an earlier run has already written to
+        output_file_name for the current generation of raw/manifest.json,
+        0 if everything has to be converted again.
+    """
+    if not os.path.exists('./raw/manifest.json') or \
+       not os.path.exists(output_file_name + '.state'):
+        return 0
+    generation = json.load(open('./raw/manifest.json', 'r'))['generation']
+    state = json.load(open(output_file_name + '.state', 'r'))
+    if state['generation'] != generation:
+        return 0
+    return state['lines']
+
+def save_converted_lines(output_file_name, lines):
+    generation = -1
+    if os.path.exists('./raw/manifest.json'):
+        generation = json.load(open('./raw/manifest.json', 'r'))['generation']
+    json.dump({'generation': generation, 'lines': lines},
+              open(output_file_name + '.state', 'w'))
+
+def cnn_example(encoder_seq_ids, decoder_seq_ids, seed_id, artist_seq,
+                genre_seq, seed_artist, seed_genre):
+    # decoder_seq_len = len(decoder_seq_ids)
+    decoder_seq_len = max_len
+    return tf.train.Example(features=tf.train.Features(feature={
+        'encoder_input': _list_feature(encoder_seq_ids),
+        'encoder_input_len': _int64_feature(len(encoder_seq_ids)),
+        'decoder_input': _list_feature(decoder_seq_ids),
+        'decoder_input_len': _int64_feature(decoder_seq_len),
+        'seed_ids': _int64_feature(seed_id),
+        'artist_input': _list_feature(artist_seq),
+        'genre_input': _list_feature(genre_seq),
+        'seed_artist_input': _int64_feature(seed_artist),
+        'seed_genre_input': _int64_feature(seed_genre),
+    }))
+
+def rnn_example(encoder_seq_ids, decoder_seq_ids, seed_id):
+    encoder_seq_ids = [1] + encoder_seq_ids + [2]
+    decoder_seq_ids = [1] + decoder_seq_ids + [2]
+    return tf.train.Example(features=tf.train.Features(feature={
+        'encoder_input': _list_feature(encoder_seq_ids),
+        'encoder_input_len': _int64_feature(len(encoder_seq_ids) - 1),
+        'decoder_input': _list_feature(decoder_seq_ids),
+        'decoder_input_len': _int64_feature(len(decoder_seq_ids) - 1),
+        'seed_ids': _int64_feature(seed_id)
+    }))
+
+_shard_data = None
+
+def load_shard_data(mode):
+    """ loaded once in every worker process """
+    global _shard_data
+    encoder_tokens, encoder_offsets = load_csr('./{}_ids_raw_data'.format(mode))
+    decoder_tokens, decoder_offsets = load_csr('./{}_ids_rerank_data'.format(mode))
+    seed_file = load_array('./{}_ids_seed.npy'.format(mode))
+    artist_table, genre_table = load_meta_table('.')
+    _shard_data = {
+        'encoder': (encoder_tokens, encoder_offsets),
+        'decoder': (decoder_tokens, decoder_offsets),
+        'seed': seed_file,
+        'artist': artist_table,
+        'genre': genre_table,
+    }
+
+def write_shard(args):
+    """
+        write the given lines into one .tfrecords file of every format,
+        sequences are stored at their true length and the readers pad every
+        batch to max_len
+    """
+    file_names, ids, compression = args
+    encoder_tokens, encoder_offsets = _shard_data['encoder']
+    decoder_tokens, decoder_offsets = _shard_data['decoder']
+    seed_file = _shard_data['seed']
+    artist_table = _shard_data['artist']
+    genre_table = _shard_data['genre']
+
+    writers = {nn: tf.python_io.TFRecordWriter(file_name,
+                                               tfrecord_options(compression))
+               for nn, file_name in file_names.items()}
+    mx = 0
+    for i in ids:
+        encoder_seq_ids = encoder_tokens[encoder_offsets[i]:encoder_offsets[i + 1]]
+        decoder_seq_ids = decoder_tokens[decoder_offsets[i]:decoder_offsets[i + 1]]
+        seed_id = int(seed_file[i])
+
+        if 'cnn' in writers:
+            example = cnn_example(
+                encoder_seq_ids.tolist(), decoder_seq_ids.tolist(), seed_id,
+                np.take(artist_table, encoder_seq_ids).tolist(),
+                np.take(genre_table, encoder_seq_ids).tolist(),
+                int(artist_table[seed_id]), int(genre_table[seed_id])
+            )
+            writers['cnn'].write(example.SerializeToString())
+        if 'rnn' in writers:
+            example = rnn_example(encoder_seq_ids.tolist(),
+                                  decoder_seq_ids.tolist(), seed_id)
+            writers['rnn'].write(example.SerializeToString())
+        mx = max([mx, len(encoder_seq_ids), len(decoder_seq_ids)])
+    for writer in writers.values():
+        writer.close()
+    return mx
+
+def shard_file_names(nn, mode, num_shards, start=0):
+    """
+        {nn}_{mode}-00000-of-000NN.tfrecords, shards appended by incremental
+        runs are named {nn}_{mode}-inc{start}-00000-of-000NN.tfrecords
+    """
+    prefix = '{}_{}'.format(nn, mode)
+    if start > 0:
+        prefix += '-inc{}'.format(start)
+    return ['{}-{:05d}-of-{:05d}.tfrecords'.format(prefix, i, num_shards)
+            for i in range(num_shards)]
+
+def convert_to_tf_format(mode, formats=('cnn', 'rnn'), incremental=False,
+                         num_shards=1, workers=1, compression='none',
+                         shuffle=True, seed=0):
+    """
+        With shuffle, the lines are spread over the shards in the order of a
+        seeded permutation, so the readers only need a small shuffle buffer.
+        Incremental runs shuffle the newly added lines among themselves.
+    """
+    seed_file = load_array('./{}_ids_seed.npy'.format(mode))
+    num_lines = len(seed_file)
+
+    starts = [converted_lines('{}_{}.tfrecords'.format(nn, mode))
+              if incremental else 0 for nn in formats]
+    # formats converted up to different lines are converted again
+    start = starts[0] if len(set(starts)) == 1 else 0
+    if start > num_lines:
+        start = 0
+    if start == num_lines:
+        print('{}: nothing to convert'.format(mode))
+        return
+    if start == 0:
+        for nn in formats:
+            for file_name in glob.glob('{}_{}*.tfrecords'.format(nn, mode)):
+                os.remove(file_name)
+    # compile the artist / genre tables before the workers load them
+    load_meta_table('.')
+
+    num_shards = max(min(num_shards, num_lines - start), 1)
+    file_names = {nn: shard_file_names(nn, mode, num_shards, start)
+                  for nn in formats}
+    ids = np.arange(start, num_lines)
+    if shuffle:
+        ids = np.random.RandomState(seed + start).permutation(ids)
+    tasks = [({nn: file_names[nn][i] for nn in formats},
+              ids[len(ids) * i // num_shards:len(ids) * (i + 1) // num_shards],
+              compression)
+             for i in range(num_shards)]
+    if workers > 1:
+        with Pool(min(workers, num_shards), initializer=load_shard_data,
+                  initargs=(mode,)) as pool:
+            mx = list(tqdm(pool.imap(write_shard, tasks), total=num_shards))
+    else:
+        load_shard_data(mode)
+        mx = [write_shard(task) for task in tqdm(tasks)]
+
+    print('{}\'s max_len: {}'.format(mode, max(mx)))
+    print('num of data: %d' % (num_lines - start))
+    for nn in formats:
+        save_converted_lines('{}_{}.tfrecords'.format(nn, mode), num_lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_len', type=int, default=max_len,
+                        help='decoder_input_len of the cnn records')
+    parser.add_argument('--formats', type=str, default='cnn,rnn',
+                        help='comma separated formats to write')
+    parser.add_argument('--incremental', type=int, default=0,
+                        help='only append records of newly added lines')
+    parser.add_argument('--num_shards', type=int, default=16,
+                        help='number of .tfrecords files per mode')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes writing shards')
+    parser.add_argument('--compression', type=str, default='none',
+                        choices=['none', 'gzip', 'zlib'],
+                        help='must match --compression of main.py')
+    parser.add_argument('--shuffle', type=int, default=1,
+                        help='write the lines in a random order')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    args = parser.parse_args()
+
+    max_len = args.max_len
+    formats = tuple(args.formats.split(','))
+    print('max_len should be less or equal to {} ({} for rnn)'.format(
+        max_len, max_len - 2
+    ))
+    for mode in ['train', 'valid']:
+        convert_to_tf_format(mode, formats, args.incremental == 1,
+                             args.num_shards, args.workers, args.compression,
+                             args.shuffle == 1, args.seed)
@@ -29,7 +29,9 @@ def params_setup():
     parser.add_argument('--debug', type=int, default=0, help='')
     parser.add_argument('--beam_search', type=int, default=1, help='')
     parser.add_argument('--beam_width', type=int, default=1, help='')
-    parser.add_argument('--num_samples', type=int, default=0, help='')
+    parser.add_argument('--num_samples', type=int, default=0,
+                        help='sampled softmax over this many classes in cnn '
+                             'training, 0 for the full softmax')
     parser.add_argument('--dropout', type=float, default=0.2, help='')
     parser.add_argument("--start_decay_step", type=int, default=20000, help='')
     parser.add_argument('--decay_steps', type=int, default=10000, help='')
@@ -38,9 +40,61 @@ def params_setup():
     parser.add_argument('--scheduled_sampling', type=int, default=1, help='')
     parser.add_argument('--model_dir', type=str, default='models', help='')
     parser.add_argument('--rl', type=int, default=0, help='')
+    parser.add_argument('--min_after_dequeue', type=int, default=256,
+                        help='shuffle queue of the rnn reader, the shards '
+                             'are already shuffled when written')
+    parser.add_argument('--compression', type=str, default='none',
+                        choices=['none', 'gzip', 'zlib'],
+                        help='compression of the .tfrecords files')
 
     # parameters for cnn
     parser.add_argument('--batch_norm', type=int, default=1, help='')
+    parser.add_argument('--num_readers', type=int, default=4,
+                        help='number of .tfrecords shards read in parallel, '
+                             'number of reader threads for rnn')
+    parser.add_argument('--num_parallel_calls', type=int, default=4,
+                        help='number of threads parsing batches')
+    parser.add_argument('--shuffle_buffer', type=int, default=256,
+                        help='number of examples in the shuffle buffer, the '
+                             'shards are already shuffled when written')
+    parser.add_argument('--prefetch_buffer', type=int, default=2,
+                        help='number of batches prepared ahead')
+    parser.add_argument('--valid_full_pass', type=int, default=0,
+                        help='validate on the whole validation split instead '
+                             'of one random batch')
+    parser.add_argument('--valid_max_seconds', type=float, default=0,
+                        help='stop a full validation pass after this many '
+                             'seconds, 0 for no limit')
+    parser.add_argument('--async_valid', type=int, default=0,
+                        help='validate checkpoints in a background process '
+                             'instead of inside the training loop')
+    parser.add_argument('--valid_poll_seconds', type=float, default=10,
+                        help='how often the validation worker looks for new '
+                             'checkpoints')
+    parser.add_argument('--max_to_keep', type=int, default=1,
+                        help='number of checkpoints kept, 0 keeps all, at '
+                             'least 5 with --async_valid so none is removed '
+                             'before it is validated')
+    parser.add_argument('--candidate_scoring', type=int, default=0,
+                        help='only score the songs of the input playlist, the '
+                             'seed and the special symbols instead of the '
+                             'whole vocab')
+    parser.add_argument('--sampling', type=str, default='full',
+                        choices=['full', 'top_k', 'nucleus', 'candidates'],
+                        help='how rl samples songs: from the whole vocab, the '
+                             'sampling_k most likely songs, the most likely '
+                             'songs holding sampling_p of the probability or '
+                             'the songs of the input playlist')
+    parser.add_argument('--sampling_k', type=int, default=50,
+                        help='songs kept by top_k and nucleus sampling')
+    parser.add_argument('--sampling_p', type=float, default=0.9,
+                        help='probability kept by nucleus sampling')
+    parser.add_argument('--data_in_memory', type=int, default=0,
+                        help='keep the split in memory instead of reading '
+                             '.tfrecords')
+    parser.add_argument('--bucket_width', type=int, default=10,
+                        help='batch playlists by length in buckets of this '
+                             'width, 0 pads every batch to max_len')
 
     para = parser.parse_args()
 
@@ -60,9 +114,18 @@ def params_setup():
         para.num_layers = 2
         para.batch_size = 2
         para.embedding_size = 14 # let cnn have a valid debug mode
-    if para.mode == 'rl' or para.mode == 'test' or para.mode == 'valid':
+    if para.mode == 'rl' or para.mode == 'test' or para.mode == 'valid' or \
+       para.mode == 'valid_worker':
         para.dropout = 0.0
 
+    # with one checkpoint kept, training removes it as soon as it saves the
+    # next one, before the validation worker can restore it
+    if para.async_valid == 1 and 0 < para.max_to_keep < 5:
+        print('--async_valid 1: --max_to_keep raised from {} to 5'.format(
+            para.max_to_keep
+        ))
+        para.max_to_keep = 5
+
     if para.model_dir == 'models':
         para.model_dir = './' + para.nn + '_' + para.model_dir
 
@@ -0,0 +1,382 @@
+""" binary dataset format
+
+    A split file like train_ids_raw_data.txt is stored as CSR:
+
+        train_ids_raw_data.tokens.npy: int32 [num_tokens], all rows concatenated
+        train_ids_raw_data.offsets.npy: int64 [num_rows + 1], row i is
+            tokens[offsets[i]:offsets[i + 1]]
+
+    and a file with one id per line like train_ids_seed.txt as a flat int32
+    array train_ids_seed.npy. Files are opened with mmap_mode='r', so there is
+    nothing to parse and all processes share the page cache.
+
+    The artist / genre index of every vocab id is compiled once from
+    vocab_default.txt, meta.txt, artist.txt and genre.txt into
+    vocab_artist.npy / vocab_genre.npy next to vocab_default.txt.
+
+    InMemoryDataset keeps a whole split in RAM and builds padded batches by
+    indexing, without going through .tfrecords. ValidationSet keeps the
+    validation split padded to max_len, so a batch is one fancy index.
+"""
+
+import os
+import struct
+from array import array
+
+import numpy as np
+
+__all__ = ['ArrayWriter',
+           'CSRWriter',
+           'csr_paths',
+           'load_array',
+           'load_csr',
+           'csr_rows',
+           'pad_rows',
+           'bucket_key',
+           'MIN_BUCKET_LEN',
+           'load_meta_table',
+           'InMemoryDataset',
+           'ValidationSet']
+
+_COPY_CHUNK = 1 << 22
+# bytes before the data of the .npy files ArrayWriter writes
+_HEADER_LEN = 128
+
+# the convolutions of SRCNN need at least 13 steps
+MIN_BUCKET_LEN = 13
+
+def bucket_key(length, width):
+    """
+        bucket of a playlist of this length, batches of bucket k are padded
+        to k * width (at least MIN_BUCKET_LEN, at most max_len), works on
+        ints, numpy arrays and tensors alike
+    """
+    return (length + width - 1) // width
+
+def csr_paths(prefix):
+    return prefix + '.tokens.npy', prefix + '.offsets.npy'
+
+def load_array(path):
+    return np.load(path, mmap_mode='r')
+
+def load_csr(prefix):
+    tokens_path, offsets_path = csr_paths(prefix)
+    return load_array(tokens_path), load_array(offsets_path)
+
+def csr_rows(tokens, offsets, ids):
+    """ list of rows (int32 arrays) of the given row ids """
+    return [tokens[offsets[i]:offsets[i + 1]] for i in ids]
+
+def pad_rows(tokens, offsets, ids, max_len):
+    """ rows of the given row ids, padded with 0 into [len(ids), max_len] """
+    starts = offsets[ids]
+    lengths = offsets[np.asarray(ids) + 1] - starts
+    # column of every token inside its row
+    row_starts = np.cumsum(lengths) - lengths
+    cols = np.arange(lengths.sum()) - np.repeat(row_starts, lengths)
+    rows = np.repeat(np.arange(len(ids)), lengths)
+
+    positions = np.repeat(starts, lengths) + cols
+    # longer rows are cut at max_len
+    if len(lengths) > 0 and lengths.max() > max_len:
+        keep = cols < max_len
+        rows, cols, positions = rows[keep], cols[keep], positions[keep]
+
+    outputs = np.zeros((len(ids), max_len), dtype=np.int32)
+    outputs[rows, cols] = tokens[positions]
+    return outputs
+
+def _write_header(output_file, dtype, size):
+    """ .npy 1.0 header of a flat array, always _HEADER_LEN bytes long so
+        the shape can be patched in place when rows are appended """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+        np.lib.format.dtype_to_descr(dtype), size
+    )
+    magic = np.lib.format.magic(1, 0)
+    header = header.ljust(_HEADER_LEN - len(magic) - 3) + '\n'
+    output_file.seek(0)
+    output_file.write(magic)
+    output_file.write(struct.pack('<H', len(header)))
+    output_file.write(header.encode('latin1'))
+
+def _read_header(path):
+    """ shape, fortran_order, dtype and data offset of a .npy file """
+    with open(path, 'rb') as input_file:
+        version = np.lib.format.read_magic(input_file)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(input_file)
+        else:
+            header = np.lib.format.read_array_header_2_0(input_file)
+        return header + (input_file.tell(),)
+
+class ArrayWriter():
+    """
+        streams values into a flat .npy file
+
+        A new file is written to path.tmp and moved into place on close.
+        With append=True the values are written after the data of the
+        existing file and only its header is rewritten on close, so an
+        append costs the size of the new values. Until then readers see
+        the old shape, and whatever an interrupted append left after the
+        data is dropped by the next one.
+    """
+
+    def __init__(self, path, dtype=np.int32, append=False):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.typecode = 'i' if self.dtype == np.int32 else 'q'
+        self.tmp_path = None
+        self.size = 0
+
+        old_size = 0
+        in_place = False
+        if append and os.path.exists(path):
+            shape, fortran_order, old_dtype, offset = _read_header(path)
+            if old_dtype != self.dtype or len(shape) != 1 or fortran_order:
+                raise ValueError('cannot append {} values to {}'.format(
+                    self.dtype, path
+                ))
+            old_size = shape[0]
+            in_place = offset == _HEADER_LEN
+
+        if in_place:
+            self.output_file = open(path, 'r+b', buffering=1 << 20)
+            self.truncate(old_size)
+        else:
+            self.tmp_path = path + '.tmp'
+            self.output_file = open(self.tmp_path, 'w+b', buffering=1 << 20)
+            _write_header(self.output_file, self.dtype, 0)
+            if old_size > 0:
+                # written by np.save, its header has no room to grow, so it
+                # is copied once under a header that has
+                old = load_array(path)
+                for i in range(0, old_size, _COPY_CHUNK):
+                    self.output_file.write(
+                        np.ascontiguousarray(old[i:i + _COPY_CHUNK]).tobytes()
+                    )
+                del old
+                self.size = old_size
+
+    def truncate(self, size):
+        """ keep only the first size values """
+        self.output_file.truncate(_HEADER_LEN + size * self.dtype.itemsize)
+        self.output_file.seek(0, os.SEEK_END)
+        self.size = size
+
+    def write(self, values):
+        if not isinstance(values, array):
+            values = array(self.typecode, values)
+        values.tofile(self.output_file)
+        self.size += len(values)
+
+    def close(self):
+        _write_header(self.output_file, self.dtype, self.size)
+        self.output_file.close()
+        if self.tmp_path is not None:
+            os.replace(self.tmp_path, self.path)
+
+class CSRWriter():
+    """ streams variable length rows into prefix.tokens.npy / prefix.offsets.npy """
+
+    def __init__(self, prefix, append=False):
+        tokens_path, offsets_path = csr_paths(prefix)
+        self.tokens = ArrayWriter(tokens_path, np.int32, append)
+        self.offsets = ArrayWriter(offsets_path, np.int64, append)
+        if self.offsets.size == 0:
+            self.offsets.write([0])
+        else:
+            # tokens of rows whose offsets were never written
+            last = load_array(offsets_path)[self.offsets.size - 1]
+            self.tokens.truncate(int(last))
+
+    def write(self, row):
+        self.tokens.write(row)
+        self.offsets.write([self.tokens.size])
+
+    def close(self):
+        self.tokens.close()
+        self.offsets.close()
+
+def create_meta_dct(file_name, song_ids):
+    """ song id -> [artist id, genre id] of the given song ids """
+    dct = {}
+    with open(file_name, 'r') as input_file:
+        for line in input_file:
+            seq = line.split(' ')
+            if int(seq[0]) in song_ids:
+                dct[int(seq[0])] = [int(seq[1]), int(seq[2])]
+    dct[2] = [0, 0]
+    return dct
+
+def create_index_dct(file_name):
+    """ id -> line number """
+    input_file = open(file_name, 'r').read().splitlines()
+    return {int(ID): i for i, ID in enumerate(input_file)}
+
+def compile_meta_table(data_dir):
+    vocab_list = open(os.path.join(data_dir, 'vocab_default.txt'), 'r') \
+                 .read().splitlines()
+    # special symbols are looked up as song 0
+    song_ids = [0] * 4 + [int(word) for word in vocab_list[4:]]
+    meta_dct = create_meta_dct(os.path.join(data_dir, 'meta.txt'),
+                               set(song_ids))
+    artist_dct = create_index_dct(os.path.join(data_dir, 'artist.txt'))
+    genre_dct = create_index_dct(os.path.join(data_dir, 'genre.txt'))
+
+    artist_table = np.zeros(len(song_ids), dtype=np.int32)
+    genre_table = np.zeros(len(song_ids), dtype=np.int32)
+    for i, song_id in enumerate(song_ids):
+        if song_id in meta_dct:
+            artist_id, genre_id = meta_dct[song_id]
+            artist_table[i] = artist_dct.get(artist_id, 0)
+            genre_table[i] = genre_dct.get(genre_id, 0)
+    np.save(os.path.join(data_dir, 'vocab_artist.npy'), artist_table)
+    np.save(os.path.join(data_dir, 'vocab_genre.npy'), genre_table)
+
+def load_meta_table(data_dir='./data'):
+    """
+        (artist_table, genre_table): int32 arrays indexed by vocab id, so
+        np.take(artist_table, ids) gives the artist inputs of a whole batch.
+        The tables are compiled again when one of their sources is newer.
+    """
+    paths = [os.path.join(data_dir, name)
+             for name in ['vocab_artist.npy', 'vocab_genre.npy']]
+    sources = [os.path.join(data_dir, name) for name in
+               ['vocab_default.txt', 'meta.txt', 'artist.txt', 'genre.txt']]
+    if not all(os.path.exists(path) for path in paths) or \
+       min(os.path.getmtime(path) for path in paths) < \
+       max(os.path.getmtime(path) for path in sources):
+        compile_meta_table(data_dir)
+    return np.load(paths[0]), np.load(paths[1])
+
+class InMemoryDataset():
+    """
+        A split loaded into contiguous int32 arrays. Batches are sampled by
+        permuting the row ids every epoch, the artist / genre inputs are looked
+        up once at load time.
+
+        With bucket_width > 0, every pool of pool_size batches is sorted by
+        length and cut into batches, which are shuffled again, so a batch is
+        padded to its longest playlist instead of max_len.
+    """
+
+    def __init__(self, data_dir, mode, batch_size, max_len, bucket_width=0,
+                 min_len=MIN_BUCKET_LEN, pool_size=50, seed=None):
+        prefix = os.path.join(data_dir, '{}_ids_'.format(mode))
+        encoder_tokens, self.encoder_offsets = load_csr(prefix + 'raw_data')
+        decoder_tokens, self.decoder_offsets = load_csr(prefix + 'rerank_data')
+        self.encoder_tokens = np.ascontiguousarray(encoder_tokens)
+        self.decoder_tokens = np.ascontiguousarray(decoder_tokens)
+        self.encoder_offsets = np.ascontiguousarray(self.encoder_offsets)
+        self.decoder_offsets = np.ascontiguousarray(self.decoder_offsets)
+        self.seed_ids = np.ascontiguousarray(load_array(prefix + 'seed.npy'))
+
+        artist_table, genre_table = load_meta_table(data_dir)
+        self.artist_tokens = np.take(artist_table, self.encoder_tokens)
+        self.genre_tokens = np.take(genre_table, self.encoder_tokens)
+        self.seed_artist_ids = np.take(artist_table, self.seed_ids)
+        self.seed_genre_ids = np.take(genre_table, self.seed_ids)
+
+        self.encoder_lengths = np.diff(self.encoder_offsets).astype(np.int32)
+        self.lengths = np.maximum(self.encoder_lengths,
+                                  np.diff(self.decoder_offsets))
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.bucket_width = bucket_width
+        self.min_len = min_len
+        self.pool_size = pool_size
+        self.rng = np.random.RandomState(seed)
+        self.batches = []
+        print('{} examples of {} in memory'.format(len(self.seed_ids), mode))
+
+    def __len__(self):
+        return len(self.seed_ids)
+
+    def new_epoch(self):
+        ids = self.rng.permutation(len(self.seed_ids))
+        num_batches = len(ids) // self.batch_size
+        if num_batches == 0:
+            raise ValueError('fewer examples than batch_size')
+        ids = ids[:num_batches * self.batch_size]
+        if self.bucket_width > 0:
+            pool = self.batch_size * self.pool_size
+            ids = np.concatenate([
+                chunk[np.argsort(self.lengths[chunk], kind='mergesort')]
+                for chunk in np.split(ids, range(pool, len(ids), pool))
+            ])
+        batches = ids.reshape(num_batches, self.batch_size)
+        self.batches = list(batches[self.rng.permutation(num_batches)])
+
+    def next_batch(self):
+        """
+            encoder_inputs, encoder_inputs_len, decoder_inputs,
+            decoder_inputs_len, seed_ids, artist_inputs, genre_inputs,
+            seed_artist_inputs, seed_genre_inputs as in the .tfrecords reader
+        """
+        if len(self.batches) == 0:
+            self.new_epoch()
+        return self.get_batch(self.batches.pop())
+
+    def get_batch(self, ids):
+        if self.bucket_width > 0:
+            max_len = int(self.lengths[ids].max())
+            max_len = max(bucket_key(max_len, self.bucket_width) *
+                          self.bucket_width, self.min_len)
+            max_len = min(max_len, self.max_len)
+        else:
+            max_len = self.max_len
+
+        encoder_inputs = pad_rows(self.encoder_tokens, self.encoder_offsets,
+                                  ids, max_len)
+        decoder_inputs = pad_rows(self.decoder_tokens, self.decoder_offsets,
+                                  ids, max_len)
+        artist_inputs = pad_rows(self.artist_tokens, self.encoder_offsets,
+                                 ids, max_len)
+        genre_inputs = pad_rows(self.genre_tokens, self.encoder_offsets,
+                                ids, max_len)
+        encoder_inputs_len = self.encoder_lengths[ids]
+        # every padded step of the decoder is predicted
+        decoder_inputs_len = np.full(len(ids), max_len, dtype=np.int32)
+
+        return encoder_inputs, encoder_inputs_len, decoder_inputs, \
+               decoder_inputs_len, self.seed_ids[ids], artist_inputs, \
+               genre_inputs, self.seed_artist_ids[ids], self.seed_genre_ids[ids]
+
+class ValidationSet():
+    """ the validation split, loaded and padded to max_len once """
+
+    def __init__(self, data_dir, max_len, seed=None):
+        prefix = os.path.join(data_dir, 'valid_ids_')
+        encoder_tokens, encoder_offsets = load_csr(prefix + 'raw_data')
+        decoder_tokens, decoder_offsets = load_csr(prefix + 'rerank_data')
+        ids = np.arange(len(encoder_offsets) - 1)
+
+        artist_table, genre_table = load_meta_table(data_dir)
+        self.encoder_inputs = pad_rows(encoder_tokens, encoder_offsets, ids,
+                                       max_len)
+        self.decoder_targets = pad_rows(decoder_tokens, decoder_offsets, ids,
+                                        max_len)
+        self.artist_inputs = np.take(artist_table, self.encoder_inputs)
+        self.genre_inputs = np.take(genre_table, self.encoder_inputs)
+        self.seed_song_inputs = np.array(load_array(prefix + 'seed.npy'))
+        self.seed_artist_inputs = np.take(artist_table, self.seed_song_inputs)
+        self.seed_genre_inputs = np.take(genre_table, self.seed_song_inputs)
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return len(self.seed_song_inputs)
+
+    def get_batch(self, ids):
+        """
+            encoder_inputs, seed_song_inputs, decoder_targets, artist_inputs,
+            genre_inputs, seed_artist_inputs, seed_genre_inputs
+        """
+        return self.encoder_inputs[ids], self.seed_song_inputs[ids], \
+               self.decoder_targets[ids], self.artist_inputs[ids], \
+               self.genre_inputs[ids], self.seed_artist_inputs[ids], \
+               self.seed_genre_inputs[ids]
+
+    def sample(self, batch_size):
+        """ batch_size random sequences without replacement """
+        return self.get_batch(self.rng.choice(len(self), batch_size,
+                                              replace=False))
@@ -8,6 +8,7 @@ from tensorflow.contrib.seq2seq.python.ops import attention_wrapper
 from tensorflow.python.layers.core import Dense, dense
 
 from lib.utils import read_num_of_lines
+from lib.utils import pad_batch, tfrecord_options
 
 __all__ = ['Multi_Task_Sea2Seq']
 
@@ -380,13 +381,14 @@ class Multi_Task_Seq2Seq():
     def read_batch_sequences(self, mode):
         """ read a batch from .tfrecords """
 
+        # rnn_{mode}-NNNNN-of-NNNNN.tfrecords and the files of incremental runs
         file_queue = tf.train.string_input_producer(
-            ['./data/rnn_{}.tfrecords'.format(mode)]
+            tf.gfile.Glob('./data/rnn_{}*.tfrecords'.format(mode))
         )
 
         ei, ei_len, di, di_len, sid = self.read_one_sequence(file_queue)
 
-        min_after_dequeue = 3000
+        min_after_dequeue = self.para.min_after_dequeue
         capacity = min_after_dequeue + 3 * self.para.batch_size
 
         encoder_inputs, encoder_inputs_len, decoder_inputs, decoder_inputs_len, \
@@ -394,10 +396,12 @@ class Multi_Task_Seq2Seq():
             [ei, ei_len, di, di_len, sid],
             batch_size=self.para.batch_size,
             capacity=capacity,
-            min_after_dequeue=min_after_dequeue
+            min_after_dequeue=min_after_dequeue,
+            num_threads=self.para.num_readers
         )
-        encoder_inputs = tf.sparse_tensor_to_dense(encoder_inputs)
-        decoder_inputs = tf.sparse_tensor_to_dense(decoder_inputs)
+        # sequences are stored with _BOS and _EOS at their true length
+        encoder_inputs = pad_batch(encoder_inputs, self.para.max_len + 1)
+        decoder_inputs = pad_batch(decoder_inputs, self.para.max_len + 1)
 
         encoder_inputs_len = tf.reshape(encoder_inputs_len,
                                         [self.para.batch_size])
@@ -409,7 +413,9 @@ class Multi_Task_Seq2Seq():
     def read_one_sequence(self, file_queue):
         """ read one sequence from .tfrecords"""
 
-        reader = tf.TFRecordReader()
+        reader = tf.TFRecordReader(
+            options=tfrecord_options(self.para.compression)
+        )
 
         _, serialized_example = reader.read(file_queue)
 
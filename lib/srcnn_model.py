@@ -4,9 +4,10 @@ from copy import deepcopy
 
 import tensorflow as tf
 import tensorflow.contrib.seq2seq as seq2seq
-from tensorflow.python.layers.core import dense
 
+from lib.dataset import bucket_key, MIN_BUCKET_LEN
 from lib.utils import read_num_of_lines
+from lib.utils import pad_batch, tfrecord_compression_type
 
 class SRCNN():
     def __init__(self, para):
@@ -22,9 +23,6 @@ class SRCNN():
                 self.build_graph()
                 self.build_optimizer()
 
-                tf.get_variable_scope().reuse_variables()
-                self.build_valid_graph()
-
         elif self.para.mode == 'rl':
             print('build reinforcement learning graph')
             with tf.name_scope('rl'):
@@ -44,13 +42,22 @@ class SRCNN():
                 self.set_input()
                 self.build_graph()
 
+        elif self.para.mode == 'valid_worker':
+            # only the validation loss, it restores checkpoints of training
+            print('build validation worker graph')
+            with tf.name_scope('train'):
+                self.set_input()
+                self.build_graph()
+
         # saver must be called after all definition of variables
-        self.saver = tf.train.Saver(max_to_keep=1)
+        self.saver = tf.train.Saver(max_to_keep=self.para.max_to_keep)
 
     def set_input(self):
         """
             This funciton contructs all input data for all modes.
 
+            max_len is the padded length of every batch
+
             encoder_inputs: [batch_size, max_len]
             encoder_inputs: [batch_size]
             seed_song_inpuds: [max_len]
@@ -58,6 +65,7 @@ class SRCNN():
             decoder_inputs_len: [batch_size]
             decoder_targets: [batch_size, max_len]
             sampled_ids_inputs:[batch_size, max_len]
+            sampling_ids_inputs: [batch_size, max_len, sampling_k]
             rewards: [batch_size]
             artist_input: [batch_size, max_len]
             genre_input: [batch_size, max_len]
@@ -71,60 +79,55 @@ class SRCNN():
             self.raw_decoder_inputs, self.raw_decoder_inputs_len, \
             self.raw_seed_song_inputs, self.raw_artist_inputs, \
             self.raw_genre_inputs, self.raw_seed_artist_inputs, \
-            self.raw_seed_genre_inputs = self.read_batch_sequences(self.para.mode)
+            self.raw_seed_genre_inputs = self.read_inputs(self.para.mode)
 
-            self.encoder_inputs = self.raw_encoder_inputs
+            # validation batches can be fed in place of the batches read here
+            self.encoder_inputs = tf.placeholder_with_default(
+                self.raw_encoder_inputs, shape=(None, None),
+                name='encoder_inputs'
+            )
             self.encoder_inputs_len = self.raw_encoder_inputs_len
-            self.seed_song_inputs = self.raw_seed_song_inputs
+            self.seed_song_inputs = tf.placeholder_with_default(
+                self.raw_seed_song_inputs, shape=(None,),
+                name='seed_song_inputs'
+            )
             self.decoder_inputs = self.raw_decoder_inputs
             self.decoder_inputs_len = self.raw_decoder_inputs_len
-            self.decoder_targets = self.raw_decoder_inputs
+            self.decoder_targets = tf.placeholder_with_default(
+                self.raw_decoder_inputs, shape=(None, None),
+                name='decoder_targets'
+            )
 
-            self.artist_inputs = self.raw_artist_inputs
-            self.genre_inputs = self.raw_genre_inputs
-            self.seed_artist_inputs = self.raw_seed_artist_inputs
-            self.seed_genre_inputs = self.raw_seed_genre_inputs
+            self.artist_inputs = tf.placeholder_with_default(
+                self.raw_artist_inputs, shape=(None, None),
+                name='artist_inputs'
+            )
+            self.genre_inputs = tf.placeholder_with_default(
+                self.raw_genre_inputs, shape=(None, None),
+                name='genre_inputs'
+            )
+            self.seed_artist_inputs = tf.placeholder_with_default(
+                self.raw_seed_artist_inputs, shape=(None,),
+                name='seed_artist_inputs'
+            )
+            self.seed_genre_inputs = tf.placeholder_with_default(
+                self.raw_seed_genre_inputs, shape=(None,),
+                name='seed_genre_inputs'
+            )
 
             self.predict_count = tf.reduce_sum(self.decoder_inputs_len)
 
             if self.para.mode == 'train':
-                self.valid_encoder_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None, self.para.max_len),
-                    name='valid_encoder_inputs'
-                )
-                self.valid_seed_song_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None,),
-                    name='valid_seed_song_inputs'
-                )
-                self.valid_decoder_targets = tf.placeholder(
-                    dtype=tf.int32, shape=(None, self.para.max_len),
-                    name='valid_decoder_targets'
-                )
-                self.valid_artist_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None, self.para.max_len),
-                    name='valid_artist_inputs'
-                )
-                self.valid_genre_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None, self.para.max_len),
-                    name='valid_genre_inputs'
-                )
-                self.valid_seed_artist_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None,),
-                    name='valid_seed_artist_inputs'
-                )
-                self.valid_seed_genre_inputs = tf.placeholder(
-                    dtype=tf.int32, shape=(None,),
-                    name='valid_seed_genre_inputs'
-                )
+                self.set_valid_input()
 
         elif self.para.mode == 'rl':
             self.raw_encoder_inputs, self.raw_encoder_inputs_len, _, _, \
             self.raw_seed_song_inputs, self.raw_artist_inputs, \
             self.raw_genre_inputs, self.raw_seed_artist_inputs, \
-            self.raw_seed_genre_inputs = self.read_batch_sequences('train')
+            self.raw_seed_genre_inputs = self.read_inputs('train')
 
             self.encoder_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='encoder_inputs'
             )
             self.encoder_inputs_len = tf.placeholder(
@@ -136,11 +139,11 @@ class SRCNN():
                 name='seed_song_inputs'
             )
             self.artist_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='artist_inputs'
             )
             self.genre_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='genre_inputs'
             )
             self.seed_artist_inputs = tf.placeholder(
@@ -152,17 +155,22 @@ class SRCNN():
                 name='seed_genre_inputs'
             )
             self.sampled_ids_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='sampled_ids_inputs'
             )
+            # the songs top_k / nucleus sampling drew sampled_ids_inputs from
+            self.sampling_ids_inputs = tf.placeholder(
+                dtype=tf.int32, shape=(None, None, self.para.sampling_k),
+                name='sampling_ids_inputs'
+            )
             self.rewards = tf.placeholder(
                 dtype=self.dtype, shape=(None,),
                 name='rewards'
             )
 
-        elif self.para.mode == 'test':
+        elif self.para.mode == 'test' or self.para.mode == 'valid_worker':
             self.encoder_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='encoder_inputs'
             )
             self.encoder_inputs_len = tf.placeholder(
@@ -174,11 +182,11 @@ class SRCNN():
                 name='seed_song_inputs'
             )
             self.artist_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='artist_inputs'
             )
             self.genre_inputs = tf.placeholder(
-                dtype=tf.int32, shape=(None, self.para.max_len),
+                dtype=tf.int32, shape=(None, None),
                 name='genre_inputs'
             )
             self.seed_artist_inputs = tf.placeholder(
@@ -190,7 +198,32 @@ class SRCNN():
                 name='seed_genre_inputs'
             )
 
+            if self.para.mode == 'valid_worker':
+                self.decoder_targets = tf.placeholder(
+                    dtype=tf.int32, shape=(None, None),
+                    name='decoder_targets'
+                )
+                self.set_valid_input()
+
+    def set_valid_input(self):
+        """
+            validation batches, padded to any length, are fed to the inputs
+            of the same network together with keep_prob = 1.0
+        """
+        self.valid_encoder_inputs = self.encoder_inputs
+        self.valid_seed_song_inputs = self.seed_song_inputs
+        self.valid_decoder_targets = self.decoder_targets
+        self.valid_artist_inputs = self.artist_inputs
+        self.valid_genre_inputs = self.genre_inputs
+        self.valid_seed_artist_inputs = self.seed_artist_inputs
+        self.valid_seed_genre_inputs = self.seed_genre_inputs
+
     def build_graph(self):
+        # the same network is validated with keep_prob = 1.0
+        self.keep_prob = tf.placeholder_with_default(
+            tf.constant(1.0 - self.para.dropout, dtype=self.dtype),
+            shape=[], name='keep_prob'
+        )
         self.encoder_embedding = tf.get_variable(
             name='encoder_embedding',
             shape=[self.para.encoder_vocab_size, self.para.embedding_size],
@@ -203,7 +236,7 @@ class SRCNN():
         )
         self.seed_song_embedded = tf.reshape(
             self.seed_song_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
+            [-1, 1, self.para.embedding_size, 1]
         )
         self.encoder_inputs_embedded = tf.nn.embedding_lookup(
             params=self.encoder_embedding,
@@ -221,7 +254,7 @@ class SRCNN():
         )
         self.seed_artist_embedded = tf.reshape(
             self.seed_artist_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
+            [-1, 1, self.para.embedding_size, 1]
         )
         self.artist_inputs_embedded = tf.nn.embedding_lookup(
             params=self.artist_embedding,
@@ -239,7 +272,7 @@ class SRCNN():
         )
         self.seed_genre_embedded = tf.reshape(
             self.seed_genre_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
+            [-1, 1, self.para.embedding_size, 1]
         )
         self.genre_inputs_embedded = tf.nn.embedding_lookup(
             params=self.genre_embedding,
@@ -259,13 +292,27 @@ class SRCNN():
         #     self.encoder_inputs_embedded, self.genre_inputs_embedded
         # )
 
-        # self.encoder_inputs_embedded: [batch_size, max_len, embedding_size, 1]
-        self.encoder_inputs_embedded = tf.reshape(
-            self.encoder_inputs_embedded,
-            [self.para.batch_size, self.para.max_len, self.para.embedding_size, 1]
+        # self.encoder_inputs_embedded: [batch_size, max_len, embedding_size, 1],
+        # max_len is the padded length of the batch
+        self.encoder_inputs_embedded = tf.expand_dims(
+            self.encoder_inputs_embedded, 3
         )
         inputs_shape = tf.shape(self.encoder_inputs_embedded)
 
+        # with bucketing, training batches are padded to their bucket and
+        # evaluation batches to max_len, so padded steps are left out of the
+        # batch normalization. A step of a VALID convolution is real if its
+        # window holds a song. --bucket_width 0 keeps the statistics of the
+        # whole padded batch, as models trained without bucketing had them.
+        if self.para.bucket_width > 0:
+            steps_mask = tf.expand_dims(tf.expand_dims(
+                tf.to_float(tf.not_equal(self.encoder_inputs, 0)), 2
+            ), 3)
+            conv1_mask = self.window_mask(steps_mask, self.weights['w1'])
+            conv3_mask = self.window_mask(conv1_mask, self.weights['w3'])
+        else:
+            steps_mask, conv1_mask, conv3_mask = None, None, None
+
         print('SRCNN\'s input: ' , end='')
         print(self.encoder_inputs_embedded.get_shape())
         conv1 = tf.nn.conv2d(
@@ -281,12 +328,13 @@ class SRCNN():
                 conv1,
                 self.offsets['o1'],
                 self.scales['s1'],
-                'conv1'
+                'conv1',
+                conv1_mask
             )
         conv1_relu = tf.nn.relu(conv1_bn + self.biases['b1'])
         conv1_relu = tf.nn.dropout(
             conv1_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
         conv2 = tf.nn.conv2d(
             input=conv1_relu,
@@ -301,12 +349,13 @@ class SRCNN():
                 conv2,
                 self.offsets['o2'],
                 self.scales['s2'],
-                'conv2'
+                'conv2',
+                conv1_mask
             )
         conv2_relu = tf.nn.relu(conv2_bn + self.biases['b2'])
         conv2_relu = tf.nn.dropout(
             conv2_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
         conv3 = tf.nn.conv2d(
             input=conv2_relu,
@@ -321,12 +370,13 @@ class SRCNN():
                 conv3,
                 self.offsets['o3'],
                 self.scales['s3'],
-                'conv3'
+                'conv3',
+                conv3_mask
             )
         conv3_relu = tf.nn.relu(conv3_bn + self.biases['b3'])
         conv3_relu = tf.nn.dropout(
             conv3_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
         inv_conv3 = tf.nn.conv2d_transpose(
             conv3_relu,
@@ -343,12 +393,13 @@ class SRCNN():
                 inv_conv3,
                 self.offsets['inv_o3'],
                 self.scales['inv_s3'],
-                'inv_conv3'
+                'inv_conv3',
+                conv1_mask
             )
         inv_conv3_relu = tf.nn.relu(inv_conv3_bn + self.biases['inv_b3'])
         inv_conv3_relu = tf.nn.dropout(
             inv_conv3_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
         inv_conv2 = tf.nn.conv2d_transpose(
             inv_conv3_relu,
@@ -365,12 +416,13 @@ class SRCNN():
                 inv_conv2,
                 self.offsets['inv_o2'],
                 self.scales['inv_s2'],
-                'inv_conv2'
+                'inv_conv2',
+                conv1_mask
             )
         inv_conv2_relu = tf.nn.relu(inv_conv2_bn + self.biases['inv_b2'])
         inv_conv2_relu = tf.nn.dropout(
             inv_conv2_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
         inv_conv1 = tf.nn.conv2d_transpose(
             inv_conv2_relu,
@@ -392,235 +444,103 @@ class SRCNN():
                 inv_conv1,
                 self.offsets['inv_o1'],
                 self.scales['inv_s1'],
-                'inv_conv1'
+                'inv_conv1',
+                steps_mask
             )
         inv_conv1_relu = tf.nn.relu(inv_conv1_bn + self.biases['inv_b1'])
         inv_conv1_relu = tf.nn.dropout(
             inv_conv1_relu,
-            keep_prob=(1.0 - self.para.dropout)
+            keep_prob=self.keep_prob
         )
+        # validation batches may be smaller than batch_size
         self.embedding_outputs = tf.reshape(
             self.residual_outputs,
-            [self.para.batch_size, self.para.max_len, self.para.embedding_size]
-        )
-        self.outputs = dense(
-            inputs=self.embedding_outputs,
-            units=self.para.decoder_vocab_size,
-            name='output_projection'
+            [tf.shape(self.residual_outputs)[0], -1, self.para.embedding_size]
         )
 
-        if self.para.mode == 'train' or self.para.mode == 'valid':
-            self.loss = self.compute_loss(
-                logits=self.outputs,
-                labels=self.decoder_targets
-            )
-        elif self.para.mode == 'rl':
-            self.sampled_ids = self.get_sampled_ids(self.outputs)
+        if self.para.mode == 'rl':
+            # rollouts only need the vocab when they are drawn from it
+            candidate_scoring = self.para.sampling == 'candidates'
+        else:
+            candidate_scoring = self.para.candidate_scoring == 1
+        if candidate_scoring:
+            # only the songs of the input playlist are scored
+            self.candidates = self.get_candidates(self.encoder_inputs,
+                                                  self.seed_song_inputs)
+            self.outputs = self.candidate_scores(self.embedding_outputs,
+                                                 self.candidates)
+            self.decoder_predicted_ids = \
+                self.get_candidate_predicted_ids(self.outputs, self.candidates)
+        else:
+            self.outputs = self.project(self.embedding_outputs)
+            self.decoder_predicted_ids = self.get_predicted_ids(self.outputs)
+
+        if self.para.mode == 'rl':
+            self.build_sampling()
 
+            # the same distribution the rollouts were drawn from
             self.loss = self.compute_rl_loss(
-               logits=self.outputs,
-               labels=self.sampled_ids_inputs
+               logits=self.sampling_logits,
+               labels=self.sampled_positions
             )
         elif self.para.mode == 'test':
             # compatible with the rnn model
             self.decoder_outputs = self.outputs
-            self.decoder_predicted_ids = self.get_predicted_ids(self.outputs)
-
-    def build_valid_graph(self):
-        self.encoder_embedding = tf.get_variable(
-            name='encoder_embedding',
-            shape=[self.para.encoder_vocab_size, self.para.embedding_size],
-            dtype=self.dtype
-        )
-        # self.seed_song_embedded: [batch_size, embedding_size]
-        seed_song_embedded = tf.nn.embedding_lookup(
-            params=self.encoder_embedding,
-            ids=self.valid_seed_song_inputs
-        )
-        seed_song_embedded = tf.reshape(
-            seed_song_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
-        )
-        encoder_inputs_embedded = tf.nn.embedding_lookup(
-            params=self.encoder_embedding,
-            ids=self.valid_encoder_inputs
-        )
-
-        self.artist_embedding = tf.get_variable(
-            name='artist_embedding',
-            shape=[self.para.artist_size, self.para.embedding_size],
-            dtype=self.dtype
-        )
-        seed_artist_embedded = tf.nn.embedding_lookup(
-            params=self.artist_embedding,
-            ids=self.valid_seed_artist_inputs
-        )
-        seed_artist_embedded = tf.reshape(
-            seed_artist_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
-        )
-        artist_inputs_embedded = tf.nn.embedding_lookup(
-            params=self.artist_embedding,
-            ids=self.valid_artist_inputs
-        )
+        else:
+            targets = self.decoder_targets
+            if candidate_scoring:
+                targets = self.candidate_labels(targets, self.candidates)
 
-        self.genre_embedding = tf.get_variable(
-            name='genre_embedding',
-            shape=[self.para.genre_size, self.para.embedding_size],
-            dtype=self.dtype
-        )
-        seed_genre_embedded = tf.nn.embedding_lookup(
-            params=self.genre_embedding,
-            ids=self.valid_seed_genre_inputs
-        )
-        seed_genre_embedded = tf.reshape(
-            seed_genre_embedded,
-            [self.para.batch_size, 1, self.para.embedding_size, 1]
-        )
-        genre_inputs_embedded = tf.nn.embedding_lookup(
-            params=self.genre_embedding,
-            ids=self.valid_genre_inputs
-        )
-
-        # seed_song_embedded = tf.add(
-        #     seed_song_embedded, seed_artist_embedded
-        # )
-        # seed_song_embedded = tf.add(
-        #     seed_song_embedded, seed_genre_embedded
-        # )
-        # encoder_inputs_embedded = tf.add(
-        #     encoder_inputs_embedded, artist_inputs_embedded
-        # )
-        # encoder_inputs_embedded = tf.add(
-        #     encoder_inputs_embedded, genre_inputs_embedded
-        # )
-
-        # self.encoder_inputs_embedded: [batch_size, max_len, embedding_size, 1]
-        encoder_inputs_embedded = tf.reshape(
-            encoder_inputs_embedded,
-            [self.para.batch_size, self.para.max_len, self.para.embedding_size, 1]
-        )
-        inputs_shape = tf.shape(encoder_inputs_embedded)
-
-        valid_conv1 = tf.nn.conv2d(
-            input=encoder_inputs_embedded,
-            filter=self.weights['w1'],
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        if self.para.batch_norm == 1:
-            valid_conv1_bn = self.batch_normalization(
-                valid_conv1,
-                self.offsets['o1'],
-                self.scales['s1'],
-                'conv1'
-            )
-        valid_conv1_relu = tf.nn.relu(valid_conv1_bn + self.biases['b1'])
-        valid_conv2 = tf.nn.conv2d(
-            input=valid_conv1_relu,
-            filter=self.weights['w2'],
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        if self.para.batch_norm == 1:
-            valid_conv2_bn = self.batch_normalization(
-                valid_conv2,
-                self.offsets['o2'],
-                self.scales['s2'],
-                'conv2'
-            )
-        valid_conv2_relu = tf.nn.relu(valid_conv2_bn + self.biases['b2'])
-        valid_conv3 = tf.nn.conv2d(
-            input=valid_conv2_relu,
-            filter=self.weights['w3'],
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        if self.para.batch_norm == 1:
-            valid_conv3_bn = self.batch_normalization(
-                valid_conv3,
-                self.offsets['o3'],
-                self.scales['s3'],
-                'conv3'
-            )
-        valid_conv3_relu = tf.nn.relu(valid_conv3_bn + self.biases['b3'])
-        valid_inv_conv3 = tf.nn.conv2d_transpose(
-            valid_conv3_relu,
-            self.weights['inv_w3'],
-            tf.shape(valid_conv2_relu),
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        valid_inv_conv3 = self.residual(valid_inv_conv3, valid_conv2)
-        if self.para.batch_norm == 1:
-            valid_inv_conv3_bn = self.batch_normalization(
-                valid_inv_conv3,
-                self.offsets['inv_o3'],
-                self.scales['inv_s3'],
-                'inv_conv3'
-            )
-        valid_inv_conv3_relu = tf.nn.relu(valid_inv_conv3_bn + self.biases['inv_b3'])
-        valid_inv_conv2 = tf.nn.conv2d_transpose(
-            valid_inv_conv3_relu,
-            self.weights['inv_w2'],
-            tf.shape(valid_conv1_relu),
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        valid_inv_conv2 = self.residual(valid_inv_conv2, valid_conv1)
-        if self.para.batch_norm == 1:
-            valid_inv_conv2_bn = self.batch_normalization(
-                valid_inv_conv2,
-                self.offsets['inv_o2'],
-                self.scales['inv_s2'],
-                'inv_conv2'
-            )
-        valid_inv_conv2_relu = tf.nn.relu(valid_inv_conv2_bn + self.biases['inv_b2'])
-        valid_inv_conv1 = tf.nn.conv2d_transpose(
-            valid_inv_conv2_relu,
-            self.weights['inv_w1'],
-            inputs_shape,
-            strides=[1, 1, 1, 1],
-            padding='VALID'
-        )
-        residual_outputs = self.residual(
-            valid_inv_conv1, encoder_inputs_embedded
-        )
-        residual_outputs = self.residual(
-            residual_outputs, seed_song_embedded
-        )
-        if self.para.batch_norm == 1:
-            valid_inv_conv1_bn = self.batch_normalization(
-                valid_inv_conv1,
-                self.offsets['inv_o1'],
-                self.scales['inv_s1'],
-                'inv_conv1'
-            )
-        valid_inv_conv1_relu = tf.nn.relu(valid_inv_conv1_bn + self.biases['inv_b1'])
-        embedding_outputs = tf.reshape(
-            residual_outputs,
-            [self.para.batch_size, self.para.max_len, self.para.embedding_size]
-        )
-        outputs = dense(
-            inputs=embedding_outputs,
-            units=self.para.decoder_vocab_size,
-            name='output_projection'
-        )
+            if self.para.mode == 'train' and self.para.num_samples > 0 and \
+               not candidate_scoring:
+                # the full logits are only computed for validation
+                self.loss = self.compute_sampled_loss(
+                    inputs=self.embedding_outputs,
+                    labels=self.decoder_targets,
+                    lengths=self.decoder_inputs_len
+                )
+            elif self.para.mode != 'valid_worker':
+                self.loss = self.compute_loss(
+                    logits=self.outputs,
+                    labels=targets,
+                    lengths=self.decoder_inputs_len
+                )
 
-        self.valid_loss = self.compute_loss(
-            logits=outputs,
-            labels=self.valid_decoder_targets
-        )
-        self.valid_loss /= self.para.max_len
-        self.valid_predicted_ids = self.get_predicted_ids(outputs)
+            if self.para.mode == 'train' or self.para.mode == 'valid_worker':
+                # every step of the validation sequences is predicted, the
+                # batch may be smaller than batch_size at the end of a full
+                # pass
+                valid_len = tf.shape(targets)[1]
+                self.valid_loss = self.compute_loss(
+                    logits=self.outputs,
+                    labels=targets,
+                    lengths=tf.fill([tf.shape(targets)[0]], valid_len)
+                )
+                self.valid_loss /= tf.to_float(valid_len)
+                self.valid_predicted_ids = self.decoder_predicted_ids
 
     def residual(self, x, y):
         return tf.add(x, y)
 
-    def batch_normalization(self, input_tensor, offset, scale, name):
-        """ global normalization """
+    def batch_normalization(self, input_tensor, offset, scale, name,
+                            mask=None):
+        """
+            global normalization, given a mask ([batch_size, len, 1, 1]) the
+            statistics only cover the steps where it is 1, so the padding of
+            a batch does not change them
+        """
 
-        mean, variance = tf.nn.moments(input_tensor, [0, 1, 2])
+        if mask is None:
+            mean, variance = tf.nn.moments(input_tensor, [0, 1, 2])
+        else:
+            # a batch without a real step would divide by a zero weight
+            weights = mask * tf.ones_like(input_tensor)
+            weight_sum = tf.maximum(tf.reduce_sum(weights, [0, 1, 2]), 1.0)
+            mean = tf.reduce_sum(weights * input_tensor, [0, 1, 2]) / \
+                   weight_sum
+            variance = tf.reduce_sum(
+                weights * tf.squared_difference(input_tensor, mean), [0, 1, 2]
+            ) / weight_sum
         input_tensor_norm = tf.nn.batch_normalization(
             x=input_tensor,
             mean=mean,
@@ -632,18 +552,25 @@ class SRCNN():
         )
         return input_tensor_norm
 
-    def compute_loss(self, logits, labels):
+    def window_mask(self, mask, weight):
+        """ mask of the output steps of a VALID convolution with weight """
+        window = int(weight.get_shape()[0])
+        return tf.nn.max_pool(mask, ksize=[1, window, 1, 1],
+                              strides=[1, 1, 1, 1], padding='VALID')
+
+    def compute_loss(self, logits, labels, lengths):
         """
             logits: [batch_size, max_len, decoder_vocab_size]
             labels: [batch_size, max_len]
+            lengths: [batch_size]
         """
         crossent = tf.nn.sparse_softmax_cross_entropy_with_logits(
             labels=labels,
             logits=logits
         )
         self.masks = tf.sequence_mask(
-            lengths=self.decoder_inputs_len,
-            maxlen=self.para.max_len,
+            lengths=lengths,
+            maxlen=tf.shape(logits)[1],
             dtype=self.dtype,
             name='masks'
         )
@@ -651,22 +578,170 @@ class SRCNN():
                tf.to_float(self.para.batch_size)
         return loss
 
-    def compute_rl_loss(self, logits, labels):
+    def output_projection(self):
+        """
+            the variables of the output projection, weights are stored as
+            [decoder_vocab_size, embedding_size] so the rows of a few songs
+            are gathered and only those rows get a gradient
         """
+        with tf.variable_scope('output_projection', reuse=tf.AUTO_REUSE):
+            weights = tf.get_variable(
+                name='weights',
+                shape=[self.para.decoder_vocab_size, self.para.embedding_size],
+                dtype=self.dtype
+            )
+            bias = tf.get_variable(
+                name='bias',
+                shape=[self.para.decoder_vocab_size],
+                dtype=self.dtype,
+                initializer=tf.zeros_initializer()
+            )
+        return weights, bias
+
+    def project(self, inputs):
+        """
+            logits of the whole vocab
+
+            inputs: [batch_size, max_len, embedding_size]
             logits: [batch_size, max_len, decoder_vocab_size]
+        """
+        weights, bias = self.output_projection()
+        logits = tf.matmul(tf.reshape(inputs, [-1, self.para.embedding_size]),
+                           weights, transpose_b=True) + bias
+        return tf.reshape(logits, tf.concat([
+            tf.shape(inputs)[:2], [self.para.decoder_vocab_size]
+        ], 0))
+
+    def get_candidates(self, encoder_inputs, seed_song_inputs):
+        """
+            _PAD, _BOS, _EOS, _UNK, the seed and the songs of the input
+            playlist, in this order
+
+            encoder_inputs: [batch_size, max_len]
+            seed_song_inputs: [batch_size]
+            candidates: [batch_size, max_len + 5]
+        """
+        special = tf.tile(tf.constant([[0, 1, 2, 3]], dtype=tf.int32),
+                          [tf.shape(encoder_inputs)[0], 1])
+        return tf.concat([
+            special,
+            tf.expand_dims(tf.to_int32(seed_song_inputs), 1),
+            tf.to_int32(encoder_inputs)
+        ], axis=1)
+
+    def first_candidates(self, candidates):
+        """ [batch_size, num_candidates], False for repeated songs """
+        num_candidates = tf.shape(candidates)[1]
+        same = tf.equal(tf.expand_dims(candidates, 2),
+                        tf.expand_dims(candidates, 1))
+        # earlier[i][j]: j < i
+        earlier = tf.cast(
+            tf.matrix_band_part(tf.ones([num_candidates, num_candidates]),
+                                -1, 0) - tf.eye(num_candidates),
+            tf.bool
+        )
+        repeated = tf.reduce_any(
+            tf.logical_and(same, tf.expand_dims(earlier, 0)), axis=2
+        )
+        return tf.logical_not(repeated)
+
+    def candidate_scores(self, inputs, candidates):
+        """
+            logits of the candidates only, with the rows of the
+            output_projection weights, repeated candidates are masked out
+
+            inputs: [batch_size, max_len, embedding_size]
+            candidates: [batch_size, num_candidates]
+            scores: [batch_size, max_len, num_candidates]
+        """
+        weights, bias = self.output_projection()
+        # [batch_size, num_candidates, embedding_size]
+        candidate_weights = tf.gather(weights, candidates)
+        candidate_bias = tf.gather(bias, candidates)
+        scores = tf.matmul(inputs, candidate_weights, transpose_b=True)
+        scores += tf.expand_dims(candidate_bias, 1)
+        repeated = 1.0 - tf.to_float(self.first_candidates(candidates))
+        return scores + tf.expand_dims(repeated * -1e9, 1)
+
+    def candidate_labels(self, labels, candidates):
+        """
+            vocab ids -> positions in candidates, songs which are not
+            candidates are _UNK
+
+            labels: [batch_size, max_len]
+            candidates: [batch_size, num_candidates]
+        """
+        match = tf.logical_and(
+            tf.equal(tf.expand_dims(tf.to_int32(labels), 2),
+                     tf.expand_dims(candidates, 1)),
+            tf.expand_dims(self.first_candidates(candidates), 1)
+        )
+        positions = tf.to_int32(tf.argmax(tf.to_int32(match), axis=2))
+        unk_positions = tf.fill(tf.shape(positions), 3)
+        return tf.where(tf.reduce_any(match, axis=2), positions, unk_positions)
+
+    def get_candidate_predicted_ids(self, scores, candidates):
+        """ argmax over the candidates, mapped back to vocab ids """
+        positions = tf.to_int32(tf.argmax(scores, axis=2))
+        ids = self.candidate_ids(candidates, positions)
+        return tf.expand_dims(tf.to_int64(ids), 2)
+
+    def candidate_ids(self, candidates, positions):
+        """
+            candidates: [batch_size, num_candidates]
+            positions: [batch_size, max_len]
+            ids: [batch_size, max_len]
+        """
+        batch_ids = tf.tile(
+            tf.expand_dims(tf.range(tf.shape(positions)[0]), 1),
+            [1, tf.shape(positions)[1]]
+        )
+        return tf.gather_nd(candidates, tf.stack([batch_ids, positions], 2))
+
+    def compute_sampled_loss(self, inputs, labels, lengths):
+        """
+            sampled softmax over num_samples classes instead of
+            decoder_vocab_size, with the variables of output_projection so
+            checkpoints are interchangeable
+
+            inputs: [batch_size, max_len, embedding_size]
             labels: [batch_size, max_len]
+            lengths: [batch_size]
         """
-        # log_p: [batch_size, max_len, decoder_vocab_size]
-        log_p = -tf.log(
-            tf.add(tf.nn.softmax(logits), tf.constant(1e-8, dtype=self.dtype))
+        weights, bias = self.output_projection()
+        crossent = tf.nn.sampled_softmax_loss(
+            weights=weights,
+            biases=bias,
+            labels=tf.reshape(tf.to_int64(labels), [-1, 1]),
+            inputs=tf.reshape(inputs, [-1, self.para.embedding_size]),
+            num_sampled=self.para.num_samples,
+            num_classes=self.para.decoder_vocab_size
+        )
+        crossent = tf.reshape(crossent, tf.shape(labels))
+        self.masks = tf.sequence_mask(
+            lengths=lengths,
+            maxlen=tf.shape(labels)[1],
+            dtype=self.dtype,
+            name='masks'
         )
-        # labels: [batch_size, max_len, decoder_vocab_size]
-        labels = tf.one_hot(
-            indices=labels,
-            depth=self.para.decoder_vocab_size
+        loss = tf.reduce_sum(crossent * self.masks) / \
+               tf.to_float(self.para.batch_size)
+        return loss
+
+    def compute_rl_loss(self, logits, labels):
+        """
+            logits: [batch_size, max_len, n] of the songs sampled from
+            labels: [batch_size, max_len] in [0, n)
+        """
+        # -log p of the sampled ids only, from a log-softmax, instead of a
+        # [batch_size, max_len, decoder_vocab_size] one-hot product
+        # neg_log_p: [batch_size, max_len]
+        neg_log_p = tf.nn.sparse_softmax_cross_entropy_with_logits(
+            labels=labels,
+            logits=logits
         )
         # loss: [batch_size]
-        loss = tf.reduce_sum(tf.multiply(log_p, labels), [1, 2])
+        loss = tf.reduce_sum(neg_log_p, 1)
         loss = tf.reduce_sum(tf.multiply(loss, self.rewards)) / \
                tf.to_float(self.para.batch_size)
         return loss
@@ -700,84 +775,277 @@ class SRCNN():
 
     def get_predicted_ids(self, outputs):
         ids = tf.argmax(outputs, axis=2)
-        decoder_predicted_ids = tf.reshape(
-            ids,
-            [self.para.batch_size, self.para.max_len, 1]
-        )
+        decoder_predicted_ids = tf.expand_dims(ids, 2)
         return decoder_predicted_ids
 
-    def get_sampled_ids(self, outputs):
-        # outputs: [batch_size, max_len, decoder_vocab_size]
-        outputs = tf.reshape(
-            outputs,
-            [self.para.batch_size * self.para.max_len, self.para.decoder_vocab_size]
-        )
-        ids = tf.multinomial(outputs, num_samples=1)
-        sampled_ids = tf.reshape(ids, [self.para.batch_size, self.para.max_len])
-        return sampled_ids
+    def build_sampling(self):
+        """
+            rollouts draw one song per step from the whole vocab, or with
+            --sampling from the sampling_k most likely songs (top_k), the
+            smallest of them holding sampling_p of the probability (nucleus)
+            or the songs of the input playlist (candidates)
+
+            sampled_ids: [batch_size, max_len] vocab ids of a rollout
+            sampling_ids: [batch_size, max_len, sampling_k] the songs of
+                top_k / nucleus a rollout was drawn from, -1 for songs out of
+                the nucleus, fed back as sampling_ids_inputs
+            sampling_logits: [batch_size, max_len, n] of the songs the fed
+                sampled_ids_inputs were drawn from
+            sampled_positions: [batch_size, max_len] positions of the fed
+                sampled_ids_inputs in sampling_logits
+        """
+        sampled_ids_inputs = tf.to_int32(self.sampled_ids_inputs)
+        if self.para.sampling == 'top_k' or self.para.sampling == 'nucleus':
+            # finding the top k still needs the logits of the whole vocab,
+            # the update only scores the k songs of the rollout
+            values, indices = tf.nn.top_k(self.outputs,
+                                          k=self.para.sampling_k)
+            if self.para.sampling == 'nucleus':
+                # probabilities of the top k under the softmax of the vocab
+                log_z = tf.reduce_logsumexp(self.outputs, axis=2,
+                                            keep_dims=True)
+                probs = tf.exp(values - log_z)
+                # the most likely song is always kept
+                mass_before = tf.cumsum(probs, axis=2, exclusive=True)
+                kept = mass_before < self.para.sampling_p
+                values = tf.where(kept, values,
+                                  tf.fill(tf.shape(values), -1e9))
+                indices = tf.where(kept, indices,
+                                   tf.fill(tf.shape(indices), -1))
+            positions = self.sample_positions(values)
+            sampled_ids = self.gather_steps(indices, positions)
+            self.sampling_ids = indices
+
+            self.sampling_logits = self.sampling_scores(
+                self.embedding_outputs, self.sampling_ids_inputs
+            )
+            self.sampled_positions = self.sampling_positions(
+                sampled_ids_inputs, self.sampling_ids_inputs
+            )
+        elif self.para.sampling == 'candidates':
+            # self.outputs holds the scores of self.candidates
+            self.sampling_logits = self.outputs
+            positions = self.sample_positions(self.outputs)
+            sampled_ids = self.candidate_ids(self.candidates, positions)
+            self.sampled_positions = self.candidate_labels(sampled_ids_inputs,
+                                                           self.candidates)
+        else:
+            self.sampling_logits = self.outputs
+            sampled_ids = self.sample_positions(self.outputs)
+            self.sampled_positions = sampled_ids_inputs
+        self.sampled_ids = tf.to_int64(sampled_ids)
+
+    def sampling_scores(self, inputs, sampling_ids):
+        """
+            logits of the songs a rollout was drawn from only, -1 entries
+            are left out
+
+            inputs: [batch_size, max_len, embedding_size]
+            sampling_ids: [batch_size, max_len, k]
+            scores: [batch_size, max_len, k]
+        """
+        weights, bias = self.output_projection()
+        kept = sampling_ids >= 0
+        ids = tf.maximum(sampling_ids, 0)
+        # [batch_size, max_len, k, embedding_size]
+        sampling_weights = tf.gather(weights, ids)
+        scores = tf.squeeze(tf.matmul(tf.expand_dims(inputs, 2),
+                                      sampling_weights, transpose_b=True), 2)
+        scores += tf.gather(bias, ids)
+        return tf.where(kept, scores, tf.fill(tf.shape(scores), -1e9))
+
+    def sampling_positions(self, sampled_ids, sampling_ids):
+        """
+            positions of sampled_ids ([batch_size, max_len]) in sampling_ids
+            ([batch_size, max_len, k]), fails if one of them is missing
+        """
+        match = tf.equal(sampling_ids, tf.expand_dims(sampled_ids, 2))
+        found = tf.Assert(
+            tf.reduce_all(tf.reduce_any(match, axis=2)),
+            ['sampled_ids_inputs has a song which is not in '
+             'sampling_ids_inputs']
+        )
+        with tf.control_dependencies([found]):
+            return tf.to_int32(tf.argmax(tf.to_int32(match), axis=2))
+
+    def sample_positions(self, logits):
+        """ [batch_size, max_len, n] -> [batch_size, max_len] in [0, n) """
+        logits_shape = tf.shape(logits)
+        ids = tf.multinomial(tf.reshape(logits, [-1, logits_shape[2]]),
+                             num_samples=1)
+        return tf.to_int32(tf.reshape(ids, logits_shape[:2]))
+
+    def gather_steps(self, params, positions):
+        """
+            params: [batch_size, max_len, n]
+            positions: [batch_size, max_len]
+            returns params[b][t][positions[b][t]]: [batch_size, max_len]
+        """
+        batch_size, max_len = tf.shape(positions)[0], tf.shape(positions)[1]
+        batch_ids = tf.tile(tf.expand_dims(tf.range(batch_size), 1),
+                            [1, max_len])
+        step_ids = tf.tile(tf.expand_dims(tf.range(max_len), 0),
+                           [batch_size, 1])
+        return tf.gather_nd(params,
+                            tf.stack([batch_ids, step_ids, positions], 2))
+
+    def read_inputs(self, mode):
+        """
+            batches from .tfrecords, or placeholders fed with batches of
+            lib.dataset.InMemoryDataset when data_in_memory is set
+        """
+        if self.para.data_in_memory == 0:
+            return self.read_batch_sequences(mode)
+
+        inputs = [('encoder_inputs', (None, None)),
+                  ('encoder_inputs_len', (None,)),
+                  ('decoder_inputs', (None, None)),
+                  ('decoder_inputs_len', (None,)),
+                  ('seed_song_inputs', (None,)),
+                  ('artist_inputs', (None, None)),
+                  ('genre_inputs', (None, None)),
+                  ('seed_artist_inputs', (None,)),
+                  ('seed_genre_inputs', (None,))]
+        self.batch_inputs = [
+            tf.placeholder(dtype=tf.int32, shape=shape, name='batch_' + name)
+            for name, shape in inputs
+        ]
+        return self.batch_inputs
+
+    def batch_feed_dict(self, batch):
+        """ feed_dict of a batch of InMemoryDataset.next_batch() """
+        return dict(zip(self.batch_inputs, batch))
 
     def read_batch_sequences(self, mode):
         """ read a batch from .tfrecords """
 
-        file_queue = tf.train.string_input_producer(
-            ['./data/cnn_{}.tfrecords'.format(mode)]
-        )
-
-        ei, ei_len, di, di_len, sid, at, gn, sat, sgn = self.read_one_sequence(file_queue)
+        # cnn_{mode}-00000-of-000NN.tfrecords, ... (see data/tf_format.py)
+        file_names = tf.gfile.Glob('./data/cnn_{}*.tfrecords'.format(mode))
+        compression_type = tfrecord_compression_type(self.para.compression)
 
-        min_after_dequeue = 3000
-        capacity = min_after_dequeue + 3 * self.para.batch_size
+        # records of num_readers shards are interleaved
+        dataset = tf.data.Dataset.from_tensor_slices(file_names)
+        dataset = dataset.shuffle(len(file_names)).repeat()
+        dataset = dataset.interleave(
+            lambda file_name: tf.data.TFRecordDataset(file_name,
+                                                      compression_type),
+            cycle_length=max(min(self.para.num_readers, len(file_names)), 1),
+            block_length=1
+        )
+        dataset = dataset.shuffle(self.para.shuffle_buffer)
+        if self.para.bucket_width > 0:
+            dataset = self.bucket_batch(dataset)
+        else:
+            # parse whole batches of serialized examples at once
+            dataset = dataset.batch(self.para.batch_size)
+            dataset = dataset.map(
+                self.parse_batch,
+                num_parallel_calls=self.para.num_parallel_calls
+            )
+        dataset = dataset.prefetch(self.para.prefetch_buffer)
 
         encoder_inputs, encoder_inputs_len, decoder_inputs, decoder_inputs_len, \
         seed_ids, artist_inputs, genre_inputs, seed_artist_inputs, \
-        seed_genre_inputs = tf.train.shuffle_batch(
-            [ei, ei_len, di, di_len, sid, at, gn, sat, sgn],
-            batch_size=self.para.batch_size,
-            capacity=capacity,
-            min_after_dequeue=min_after_dequeue
-        )
-        encoder_inputs = tf.sparse_tensor_to_dense(encoder_inputs)
-        decoder_inputs = tf.sparse_tensor_to_dense(decoder_inputs)
-        artist_inputs = tf.sparse_tensor_to_dense(artist_inputs)
-        genre_inputs = tf.sparse_tensor_to_dense(genre_inputs)
+        seed_genre_inputs = dataset.make_one_shot_iterator().get_next()
 
-        encoder_inputs_len = tf.reshape(encoder_inputs_len,
-                                        [self.para.batch_size])
-        decoder_inputs_len = tf.reshape(decoder_inputs_len,
-                                        [self.para.batch_size])
-        seed_ids = tf.reshape(seed_ids, [self.para.batch_size])
-        seed_artist_inputs = tf.reshape(seed_artist_inputs, [self.para.batch_size])
-        seed_genre_inputs = tf.reshape(seed_genre_inputs, [self.para.batch_size])
+        # only the padded part of the decoder is predicted
+        decoder_inputs_len = tf.minimum(decoder_inputs_len,
+                                        tf.shape(decoder_inputs)[1])
 
-        return encoder_inputs, tf.to_int32(encoder_inputs_len), \
-               decoder_inputs, tf.to_int32(decoder_inputs_len), seed_ids, \
-               artist_inputs, genre_inputs, seed_artist_inputs, \
-               seed_genre_inputs
+        return encoder_inputs, encoder_inputs_len, decoder_inputs, \
+               decoder_inputs_len, seed_ids, artist_inputs, genre_inputs, \
+               seed_artist_inputs, seed_genre_inputs
 
-    def read_one_sequence(self, file_queue):
-        """ read one sequence from .tfrecords"""
+    def bucket_batch(self, dataset):
+        """
+            batches of playlists of similar length, padded to the upper bound
+            of their bucket instead of max_len
+        """
+        width = self.para.bucket_width
 
-        reader = tf.TFRecordReader()
+        # the same buckets as lib.dataset.InMemoryDataset
+        def key_func(*sequence):
+            encoder_inputs, decoder_inputs = sequence[0], sequence[2]
+            length = tf.maximum(tf.shape(encoder_inputs)[0],
+                                tf.shape(decoder_inputs)[0])
+            return tf.to_int64(bucket_key(length, width))
 
-        _, serialized_example = reader.read(file_queue)
+        def reduce_func(key, window):
+            bound = tf.clip_by_value(key * width, MIN_BUCKET_LEN,
+                                     self.para.max_len)
+            bound = tf.reshape(bound, [1])
+            return window.padded_batch(
+                self.para.batch_size,
+                padded_shapes=(bound, [], bound, [], [], bound, bound, [], [])
+            )
+
+        dataset = dataset.map(self.parse_sequence,
+                              num_parallel_calls=self.para.num_parallel_calls)
+        dataset = dataset.apply(tf.contrib.data.group_by_window(
+            key_func=key_func,
+            reduce_func=reduce_func,
+            window_size=self.para.batch_size
+        ))
+        # the graph is built for batch_size examples
+        return dataset.filter(
+            lambda *batch: tf.equal(tf.shape(batch[0])[0], self.para.batch_size)
+        )
+
+    def parse_sequence(self, serialized_example):
+        """ one serialized example -> unpadded sequences """
 
         feature = tf.parse_single_example(serialized_example, features={
             'encoder_input': tf.VarLenFeature(tf.int64),
-            'encoder_input_len': tf.FixedLenFeature([1], tf.int64),
+            'encoder_input_len': tf.FixedLenFeature([], tf.int64),
+            'decoder_input': tf.VarLenFeature(tf.int64),
+            'decoder_input_len': tf.FixedLenFeature([], tf.int64),
+            'seed_ids': tf.FixedLenFeature([], tf.int64),
+            'artist_input': tf.VarLenFeature(tf.int64),
+            'genre_input': tf.VarLenFeature(tf.int64),
+            'seed_artist_input': tf.FixedLenFeature([], tf.int64),
+            'seed_genre_input': tf.FixedLenFeature([], tf.int64),
+        })
+
+        def dense(name):
+            return tf.to_int32(tf.sparse_tensor_to_dense(feature[name]))
+        def scalar(name):
+            return tf.to_int32(feature[name])
+
+        return dense('encoder_input'), scalar('encoder_input_len'), \
+               dense('decoder_input'), scalar('decoder_input_len'), \
+               scalar('seed_ids'), dense('artist_input'), \
+               dense('genre_input'), scalar('seed_artist_input'), \
+               scalar('seed_genre_input')
+
+    def parse_batch(self, serialized_examples):
+        """ [batch_size] serialized examples -> padded batch """
+
+        feature = tf.parse_example(serialized_examples, features={
+            'encoder_input': tf.VarLenFeature(tf.int64),
+            'encoder_input_len': tf.FixedLenFeature([], tf.int64),
             'decoder_input': tf.VarLenFeature(tf.int64),
-            'decoder_input_len': tf.FixedLenFeature([1], tf.int64),
-            'seed_ids': tf.FixedLenFeature([1], tf.int64),
+            'decoder_input_len': tf.FixedLenFeature([], tf.int64),
+            'seed_ids': tf.FixedLenFeature([], tf.int64),
             'artist_input': tf.VarLenFeature(tf.int64),
             'genre_input': tf.VarLenFeature(tf.int64),
-            'seed_artist_input': tf.FixedLenFeature([1], tf.int64),
-            'seed_genre_input': tf.FixedLenFeature([1], tf.int64),
+            'seed_artist_input': tf.FixedLenFeature([], tf.int64),
+            'seed_genre_input': tf.FixedLenFeature([], tf.int64),
         })
 
-        return feature['encoder_input'], feature['encoder_input_len'], \
-               feature['decoder_input'], feature['decoder_input_len'], \
-               feature['seed_ids'], feature['artist_input'], \
-               feature['genre_input'], feature['seed_artist_input'], \
-               feature['seed_genre_input']
+        # sequences are stored at their true length
+        def dense(name):
+            return pad_batch(tf.to_int32(feature[name]), self.para.max_len,
+                             self.para.batch_size)
+        def scalar(name):
+            inputs = tf.to_int32(feature[name])
+            inputs.set_shape([self.para.batch_size])
+            return inputs
+
+        return dense('encoder_input'), scalar('encoder_input_len'), \
+               dense('decoder_input'), scalar('decoder_input_len'), \
+               scalar('seed_ids'), dense('artist_input'), \
+               dense('genre_input'), scalar('seed_artist_input'), \
+               scalar('seed_genre_input')
 
     def build_weights(self):
         self.weights = {
@@ -1,18 +1,25 @@
 """ data processing functions """
 
 import numpy as np
+import tensorflow as tf
 from copy import deepcopy
 from collections import defaultdict
 from math import sqrt
-from random import sample
+
+from lib.dataset import load_meta_table
 
 __all__ = ['dict_id_to_song_id',
-           'read_valid_sequences',
            'read_testing_sequences',
            'read_num_of_lines',
            'get_max_len',
            'reward_functions',
-           'cal_precision_and_recall']
+           'cal_precision',
+           'cal_recall',
+           'cal_precision_and_recall',
+           'count_true_and_false',
+           'tfrecord_options',
+           'tfrecord_compression_type',
+           'pad_batch']
 
 dictionary_path = 'data/vocab_default.txt'
 
@@ -41,78 +48,6 @@ def get_max_len(file_name):
     input_file = [seq.split(' ') for seq in input_file]
     return max([len(seq) for seq in input_file])
 
-def create_meta_dct():
-    input_file = open('./data/meta.txt', 'r').read().splitlines()
-    seqs = [seq.split(' ') for seq in input_file]
-    dct = {}
-    for seq in seqs:
-        dct[int(seq[0])] = [int(seq[1]), int(seq[2])]
-    dct[2] = [0, 0]
-    return dct
-
-def create_artist_and_genre_dct():
-    def parse_file(file_name):
-        input_file = open(file_name, 'r').read().splitlines()
-        dct = defaultdict(lambda: 0)
-        for i, ID in enumerate(input_file):
-            dct[int(ID)] = i
-        return dct
-    return parse_file('./data/artist.txt'), parse_file('./data/genre.txt')
-
-def read_valid_sequences(para):
-    encoder_file = open('./data/valid_ids_raw_data.txt', 'r').read().splitlines()
-    seed_file = open('./data/valid_ids_seed.txt', 'r').read().splitlines()
-    target_file = open('./data/valid_ids_rerank_data.txt', 'r').read().splitlines()
-
-    chosen_ids = sample(range(0, len(encoder_file)), para.batch_size)
-    encoder_inputs = []
-    seed_song_inputs = []
-    decoder_targets = []
-    for idx in chosen_ids:
-        encoder_inputs.append(encoder_file[idx].split(' '))
-        seed_song_inputs.append(seed_file[idx])
-        decoder_targets.append(target_file[idx].split(' '))
-
-    encoder_inputs = [seq + [0] * (para.max_len - len(seq)) for seq in \
-                      encoder_inputs]
-    seed_song_inputs = [int(num) for num in seed_song_inputs]
-    decoder_targets = [seq + [0] * (para.max_len - len(seq)) for seq in \
-                       decoder_targets]
-
-    encoder_inputs = [[int(ID) for ID in seq] for seq in encoder_inputs]
-    decoder_targets = [[int(ID) for ID in seq] for seq in decoder_targets]
-
-    meta_dct = create_meta_dct()
-    artist_dct, genre_dct = create_artist_and_genre_dct()
-    vocab_list = open('./data/vocab_default.txt', 'r').read().splitlines()
-    for i in range(4):
-        vocab_list[i] = 0
-    artist_inputs = []
-    genre_inputs = []
-    seed_artist_inputs = []
-    seed_genre_inputs = []
-
-    for i in range(len(encoder_inputs)):
-        artist_inputs.append(
-            [artist_dct[meta_dct[int(vocab_list[id])][0]]
-             for id in encoder_inputs[i]]
-        )
-        genre_inputs.append(
-            [genre_dct[meta_dct[int(vocab_list[id])][1]]
-             for id in encoder_inputs[i]]
-        )
-        seed_artist_inputs.append(
-            artist_dct[meta_dct[int(vocab_list[int(seed_song_inputs[i])])][0]]
-        )
-        seed_genre_inputs.append(
-            genre_dct[meta_dct[int(vocab_list[int(seed_song_inputs[i])])][1]]
-        )
-
-    return np.asarray(encoder_inputs), np.asarray(seed_song_inputs), \
-           np.asarray(decoder_targets), np.asarray(artist_inputs), \
-           np.asarray(genre_inputs), np.asarray(seed_artist_inputs), \
-           np.asarray(seed_genre_inputs)
-
 def read_testing_sequences(para):
     # filter for smybol that utf8 cannot decode
     input_file = open('results/in.txt', 'r')
@@ -141,30 +76,13 @@ def read_testing_sequences(para):
     para.batch_size = len(seqs)
     print('total num of sequences: %d' % len(seqs))
 
-    meta_dct = create_meta_dct()
-    artist_dct, genre_dct = create_artist_and_genre_dct()
-    vocab_list = open('./data/vocab_default.txt', 'r').read().splitlines()
-    for i in range(4):
-        vocab_list[i] = 0
-    artist_seqs = []
-    genre_seqs = []
-    seed_artist_seqs = []
-    seed_genre_seqs = []
-    for i in range(len(seqs)):
-        artist_seqs.append(
-            [artist_dct[meta_dct[int(vocab_list[id])][0]]
-             for id in seqs[i]]
-        )
-        genre_seqs.append(
-            [genre_dct[meta_dct[int(vocab_list[id])][1]]
-             for id in seqs[i]]
-        )
-        seed_artist_seqs.append(
-            artist_dct[meta_dct[int(vocab_list[int(seed_ids[i])])][0]]
-        )
-        seed_genre_seqs.append(
-            genre_dct[meta_dct[int(vocab_list[int(seed_ids[i])])][1]]
-        )
+    seqs = np.asarray(seqs)
+    seed_ids = np.asarray(seed_ids)
+    artist_table, genre_table = load_meta_table()
+    artist_seqs = np.take(artist_table, seqs)
+    genre_seqs = np.take(genre_table, seqs)
+    seed_artist_seqs = np.take(artist_table, seed_ids)
+    seed_genre_seqs = np.take(genre_table, seed_ids)
 
     return np.asarray(seqs), np.asarray(seqs_len), np.asarray(seed_ids), \
            np.asarray(artist_seqs), np.asarray(genre_seqs), \
@@ -226,6 +144,11 @@ def cal_recall(true_positives, false_negatives):
     return (true_positives / (true_positives + false_negatives))
 
 def cal_precision_and_recall(predicted_ids, targets):
+    tp, fp, fn = count_true_and_false(predicted_ids, targets)
+    return cal_precision(tp, fp), cal_recall(tp, fn)
+
+def count_true_and_false(predicted_ids, targets):
+    """ (true positives, false positives, false negatives) of a batch """
     predicted_ids = numpy_array_to_list(predicted_ids)
     predicted_ids = [[ID[0] for ID in seq if check_valid_song_id(ID[0])] for seq in
                      predicted_ids]
@@ -247,7 +170,7 @@ def cal_precision_and_recall(predicted_ids, targets):
         for j in range(len(targets[i])):
             if targets[i][j] not in now_set:
                 fn += 1
-    return cal_precision(tp, fp), cal_recall(tp, fn)
+    return tp, fp, fn
 
 def length_reward(seq):
     return 1 - sqrt(abs(30 - len(seq)) / 150)
@@ -274,3 +197,24 @@ def reward_functions(para, sampled_ids):
     rewards -= 0.5
 
     return rewards, msg
+
+def tfrecord_options(compression):
+    """ --compression ('none', 'gzip' or 'zlib') -> TFRecordOptions """
+    return tf.python_io.TFRecordOptions({
+        'none': tf.python_io.TFRecordCompressionType.NONE,
+        'gzip': tf.python_io.TFRecordCompressionType.GZIP,
+        'zlib': tf.python_io.TFRecordCompressionType.ZLIB,
+    }[compression])
+
+def tfrecord_compression_type(compression):
+    """ --compression -> compression_type of tf.data.TFRecordDataset """
+    return tf.python_io.TFRecordOptions.get_compression_type_string(
+        tfrecord_options(compression)
+    )
+
+def pad_batch(inputs, max_len, batch_size=None):
+    """ sparse batch of sequences -> [batch_size, max_len] """
+    inputs = tf.sparse_tensor_to_dense(inputs)
+    inputs = tf.pad(inputs, [[0, 0], [0, max_len - tf.shape(inputs)[1]]])
+    inputs.set_shape([batch_size, max_len])
+    return inputs
@@ -2,16 +2,21 @@
 
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import shutil
+import subprocess
+import sys
 import time
 
 import tensorflow as tf
 import numpy as np
 
 from lib.config import params_setup
-from lib.utils import read_testing_sequences, read_valid_sequences
-from lib.utils import cal_precision_and_recall
+from lib.utils import read_testing_sequences
+from lib.utils import cal_precision, cal_recall, cal_precision_and_recall
+from lib.utils import count_true_and_false
 from lib.utils import dict_id_to_song_id
 from lib.utils import reward_functions
+from lib.dataset import InMemoryDataset, ValidationSet
 from lib.multi_task_seq2seq_model import Multi_Task_Seq2Seq
 from lib.srcnn_model import SRCNN
 
@@ -25,21 +30,47 @@ def config_setup():
     config.allow_soft_placement = True
     return config
 
+def restore_checkpoint(sess, model, path):
+    """
+        model.saver.restore, checkpoints of the cnn model saved while the
+        output projection was a dense layer keep its kernel as
+        [embedding_size, vocab_size], it is loaded transposed into the
+        [vocab_size, embedding_size] weights
+    """
+    reader = tf.train.NewCheckpointReader(path)
+    weights = [var for var in tf.global_variables()
+               if var.op.name == 'model/output_projection/weights']
+    if len(weights) == 0 or reader.has_tensor(weights[0].op.name) or \
+       not reader.has_tensor('model/output_projection/kernel'):
+        model.saver.restore(sess, path)
+        return
+    # the optimizer slots of the weights start fresh
+    tf.train.Saver([var for var in tf.global_variables()
+                    if reader.has_tensor(var.op.name)]).restore(sess, path)
+    weights[0].load(
+        np.transpose(reader.get_tensor('model/output_projection/kernel')), sess
+    )
+
 def load_weights(para, sess, model):
     # "xxxx_rl" => "rl"
     rl_mode = para.model_dir[len(para.model_dir) - 2:]
     if rl_mode != 'rl':
-        ckpt = tf.train.get_checkpoint_state(para.model_dir)
+        ckpt_dir = para.model_dir
+        # the best checkpoint of the validation worker
+        best_dir = os.path.join(para.model_dir, 'best')
+        if para.mode != 'train' and tf.train.get_checkpoint_state(best_dir):
+            ckpt_dir = best_dir
+        ckpt = tf.train.get_checkpoint_state(ckpt_dir)
         if ckpt:
             print('Loading model from %s' % ckpt.model_checkpoint_path)
-            model.saver.restore(sess, ckpt.model_checkpoint_path)
+            restore_checkpoint(sess, model, ckpt.model_checkpoint_path)
+            result = read_result(para)
+            if result is None:
+                # saved before the validation worker validated it
+                return
 
             # load prev_valid, prev_precision, prev_recall
-            input_file = open(para.model_dir + '/result.txt', 'r').read().splitlines()
-            input_file = [seq.split(' ') for seq in input_file]
-            prev_valid_loss = float(input_file[0][1])
-            prev_precision = float(input_file[1][1])
-            prev_recall = float(input_file[2][1])
+            prev_valid_loss, prev_precision, prev_recall = result
             print('prev_valid_loss: {}'.format(prev_valid_loss))
             print('prev_precision: {}'.format(prev_precision))
             print('prev_recall: {}'.format(prev_recall))
@@ -50,14 +81,14 @@ def load_weights(para, sess, model):
         ckpt = tf.train.get_checkpoint_state(para.model_dir)
         if ckpt:
             print('Loading model from %s' % ckpt.model_checkpoint_path)
-            model.saver.restore(sess, ckpt.model_checkpoint_path)
+            restore_checkpoint(sess, model, ckpt.model_checkpoint_path)
         else:
             # "xxxx_rl" => "xxxx"
             original_dir = para.model_dir[:len(para.model_dir) - 3]
             ckpt = tf.train.get_checkpoint_state(original_dir)
             if ckpt:
                 print('Loading model from %s' % ckpt.model_checkpoint_path)
-                model.saver.restore(sess, ckpt.model_checkpoint_path)
+                restore_checkpoint(sess, model, ckpt.model_checkpoint_path)
             else:
                 print('Loading model with fresh parameters')
                 sess.run(tf.global_variables_initializer())
@@ -69,19 +100,192 @@ def save_model(para, sess, model):
     model.saver.save(sess, checkpoint_path,
                         global_step=global_step)
 
+def run_valid_batch(sess, model, batch):
+    encoder_inputs, seed_song_inputs, decoder_targets, artist_inputs, \
+    genre_inputs, seed_artist_inputs, seed_genre_inputs = batch
+    return sess.run(
+        fetches=[
+            model.valid_loss,
+            model.valid_predicted_ids,
+        ],
+        feed_dict={
+            model.valid_encoder_inputs: encoder_inputs,
+            model.valid_seed_song_inputs: seed_song_inputs,
+            model.valid_decoder_targets: decoder_targets,
+            model.valid_artist_inputs: artist_inputs,
+            model.valid_genre_inputs: genre_inputs,
+            model.valid_seed_artist_inputs: seed_artist_inputs,
+            model.valid_seed_genre_inputs: seed_genre_inputs,
+            model.keep_prob: 1.0,
+        }
+    )
+
+def validate_batch(para, sess, model, valid_set):
+    """ loss, precision and recall of one random batch """
+    batch = valid_set.sample(para.batch_size)
+    [valid_loss, predicted_ids] = run_valid_batch(sess, model, batch)
+    precision, recall = cal_precision_and_recall(predicted_ids, batch[2])
+    return valid_loss, precision, recall
+
+def validate_full_pass(para, sess, model, valid_set):
+    """
+        loss, precision and recall of the whole validation split, streamed in
+        batches of batch_size; stops early after valid_max_seconds (if > 0)
+    """
+    start_time = time.time()
+    loss_sum = 0.0
+    num = 0
+    tp, fp, fn = 0, 0, 0
+    for start in range(0, len(valid_set), para.batch_size):
+        ids = np.arange(start, min(start + para.batch_size, len(valid_set)))
+        batch = valid_set.get_batch(ids)
+        [valid_loss, predicted_ids] = run_valid_batch(sess, model, batch)
+
+        # valid_loss is summed over the batch and divided by batch_size
+        loss_sum += valid_loss * para.batch_size
+        num += len(ids)
+        batch_tp, batch_fp, batch_fn = count_true_and_false(predicted_ids,
+                                                            batch[2])
+        tp, fp, fn = tp + batch_tp, fp + batch_fp, fn + batch_fn
+
+        if para.valid_max_seconds > 0 and \
+           time.time() - start_time > para.valid_max_seconds:
+            break
+    print('valid examples: {}, '.format(num), end='')
+    return loss_sum / num, cal_precision(tp, fp), cal_recall(tp, fn)
+
+def write_result(para, valid_loss, precision, recall):
+    result_file = open(para.model_dir + '/result.txt', 'w')
+    result_file.write('perplexity: {}\n'.format(np.exp(valid_loss)))
+    result_file.write('precision: {}\n'.format(precision))
+    result_file.write('recall: {}\n'.format(recall))
+    result_file.close()
+
+def read_result(para):
+    """ valid loss, precision and recall of result.txt, None without it """
+    file_name = para.model_dir + '/result.txt'
+    if not os.path.exists(file_name):
+        return None
+    input_file = open(file_name, 'r').read().splitlines()
+    input_file = [seq.split(' ') for seq in input_file]
+    # result.txt holds the perplexity
+    return np.log(float(input_file[0][1])), float(input_file[1][1]), \
+           float(input_file[2][1])
+
+def copy_best_checkpoint(para, checkpoint_path):
+    """
+        model_dir/best is a symlink to a complete copy of the best
+        checkpoint, it is replaced atomically so valid and test never see a
+        partial copy
+    """
+    name = os.path.basename(checkpoint_path)
+    best_dir = os.path.join(para.model_dir, 'best')
+    copy_dir = os.path.join(para.model_dir, 'best-' + name)
+    tmp_dir = copy_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for file_name in tf.gfile.Glob(checkpoint_path + '.*'):
+        shutil.copy(file_name, tmp_dir)
+    # a relative path, it is resolved against the directory of the link
+    tf.train.update_checkpoint_state(tmp_dir, name)
+    os.rename(tmp_dir, copy_dir)
+
+    old_dir = None
+    if os.path.islink(best_dir):
+        old_dir = os.path.join(para.model_dir, os.readlink(best_dir))
+    elif os.path.isdir(best_dir):
+        shutil.rmtree(best_dir)
+    link_name = best_dir + '.tmp'
+    if os.path.lexists(link_name):
+        os.remove(link_name)
+    os.symlink(os.path.basename(copy_dir), link_name)
+    os.replace(link_name, best_dir)
+    if old_dir is not None and os.path.abspath(old_dir) != \
+       os.path.abspath(copy_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+def start_valid_worker(para):
+    """ the same arguments in --mode valid_worker """
+    done_file_name = os.path.join(para.model_dir, 'train.done')
+    if os.path.exists(done_file_name):
+        os.remove(done_file_name)
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] +
+        ['--mode', 'valid_worker']
+    )
+
+def stop_valid_worker(para, worker):
+    """ the worker validates the remaining checkpoints, then exits """
+    open(os.path.join(para.model_dir, 'train.done'), 'w').close()
+    print('waiting for the validation worker')
+    worker.wait()
+
+def run_valid_worker(para, sess, model, valid_set):
+    """
+        validate every checkpoint saved in model_dir, keep the best one in
+        model_dir/best until training writes model_dir/train.done
+    """
+    best_valid_loss = 10 ** 10
+    # a resumed training only replaces a better model
+    result = read_result(para)
+    if result is not None:
+        best_valid_loss = result[0]
+        print('best valid perplexity: {:.2f}'.format(np.exp(best_valid_loss)))
+    seen = set()
+    while True:
+        # checked before listing, so the last checkpoint is not missed
+        done = os.path.exists(os.path.join(para.model_dir, 'train.done'))
+        ckpt = tf.train.get_checkpoint_state(para.model_dir)
+        paths = ckpt.all_model_checkpoint_paths if ckpt else []
+        new_paths = [path for path in paths if path not in seen]
+        for path in new_paths:
+            seen.add(path)
+            try:
+                restore_checkpoint(sess, model, path)
+            except tf.errors.NotFoundError:
+                print('{}: removed by --max_to_keep {} before it was '
+                      'validated'.format(os.path.basename(path),
+                                         para.max_to_keep))
+                continue
+            if para.valid_full_pass == 1:
+                valid_loss, precision, recall = \
+                    validate_full_pass(para, sess, model, valid_set)
+            else:
+                valid_loss, precision, recall = \
+                    validate_batch(para, sess, model, valid_set)
+            print('{}: valid perplexity: {:.2f}, precision: {}, recall: {}'.format(
+                os.path.basename(path), np.exp(valid_loss), precision, recall
+            ), end='')
+            if valid_loss < best_valid_loss:
+                best_valid_loss = valid_loss
+                copy_best_checkpoint(para, path)
+                write_result(para, valid_loss, precision, recall)
+                print(' --> best model')
+            else:
+                print()
+        if done and len(new_paths) == 0:
+            break
+        if len(new_paths) == 0:
+            time.sleep(para.valid_poll_seconds)
+
 if __name__ == "__main__":
     para = params_setup()
 
     if para.nn == 'rnn' and para.mode == 'rl':
         raise NameError('there is no support of RL on rnn')
+    if para.nn == 'rnn' and (para.async_valid == 1 or
+                             para.mode == 'valid_worker'):
+        raise NameError('there is no support of async validation on rnn')
 
     try:
         os.makedirs(para.model_dir)
     except os.error:
         pass
-    para_file = open(para.model_dir + '/para.txt', 'w')
-    para_file.write(str(para))
-    para_file.close()
+    if para.mode != 'valid_worker':
+        para_file = open(para.model_dir + '/para.txt', 'w')
+        para_file.write(str(para))
+        para_file.close()
 
     print(para)
 
@@ -100,27 +304,49 @@ if __name__ == "__main__":
     for var in variables:
         print('\t{}\t{}'.format(var.name, var.get_shape()))
 
+    dataset = None
+    # the validation worker only reads valid_set
+    if para.nn == 'cnn' and para.data_in_memory == 1 and \
+       para.mode not in ['test', 'valid_worker']:
+        dataset = InMemoryDataset(
+            './data', 'valid' if para.mode == 'valid' else 'train',
+            para.batch_size, para.max_len, para.bucket_width
+        )
+
+    if para.nn == 'cnn' and (para.mode == 'train' or
+                             para.mode == 'valid_worker'):
+        valid_set = ValidationSet('./data', para.max_len)
+
     with tf.Session(config=config_setup(), graph=graph) as sess:
         # need to initialize variables no matter what you want to do later
         sess.run(tf.global_variables_initializer())
 
-        load_weights(para, sess, model)
+        if para.mode != 'valid_worker':
+            load_weights(para, sess, model)
 
         coord = tf.train.Coordinator()
         threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
+        valid_worker = None
+        if para.mode == 'train' and para.async_valid == 1:
+            valid_worker = start_valid_worker(para)
+
         try:
             if para.mode == 'train':
                 step_time = 0.0
                 for step in range(1200):
                     start_time = time.time()
 
+                    feed_dict = None
+                    if dataset is not None:
+                        feed_dict = model.batch_feed_dict(dataset.next_batch())
                     [loss, predict_count, _] = sess.run(
                         fetches=[
                             model.loss,
                             model.predict_count,
                             model.update,
                         ],
+                        feed_dict=feed_dict
                     )
 
                     loss = loss * para.batch_size
@@ -131,33 +357,25 @@ if __name__ == "__main__":
                         print('step: %d, perplexity: %.2f step_time: %.2f, ' %
                               (step, perplexity, step_time / para.steps_per_stats),
                               end='')
+                        num_steps = para.steps_per_stats if step > 0 else 1
+                        print('examples/sec: %.1f, ' %
+                              (para.batch_size * num_steps / step_time),
+                              end='')
 
-                        if para.nn == 'cnn':
-                            encoder_inputs, seed_song_inputs, decoder_targets, \
-                            artist_inputs, genre_inputs, seed_artist_inputs, \
-                            seed_genre_inputs = read_valid_sequences(para)
-
-                            [valid_loss, predicted_ids] = sess.run(
-                                fetches=[
-                                    model.valid_loss,
-                                    model.valid_predicted_ids,
-                                ],
-                                feed_dict={
-                                    model.valid_encoder_inputs: encoder_inputs,
-                                    model.valid_seed_song_inputs: seed_song_inputs,
-                                    model.valid_decoder_targets: decoder_targets,
-                                    model.valid_artist_inputs: artist_inputs,
-                                    model.valid_genre_inputs: genre_inputs,
-                                    model.valid_seed_artist_inputs: seed_artist_inputs,
-                                    model.valid_seed_genre_inputs: seed_genre_inputs,
-                                }
-                            )
+                        if valid_worker is not None:
+                            # the worker validates and keeps the best model
+                            save_model(para, sess, model)
+                            print(' --> save model to {}'.format(para.model_dir))
+                        elif para.nn == 'cnn':
+                            if para.valid_full_pass == 1:
+                                valid_loss, precision, recall = \
+                                    validate_full_pass(para, sess, model,
+                                                       valid_set)
+                            else:
+                                valid_loss, precision, recall = \
+                                    validate_batch(para, sess, model, valid_set)
                             print('valid perplexity: %.2f, ' % np.exp(valid_loss),
                                   end='')
-
-                            precision, recall = cal_precision_and_recall(
-                                predicted_ids, decoder_targets
-                            )
                             print('precision: {}, recall, {} '.format(
                                 precision, recall
                             ), end=' ')
@@ -169,12 +387,8 @@ if __name__ == "__main__":
                                 prev_recall = recall
                                 save_model(para, sess, model)
                                 print(' --> save model to {}'.format(para.model_dir))
-
-                                result_file = open(para.model_dir + '/result.txt', 'w')
-                                result_file.write('perplexity: {}\n'.format(np.exp(prev_valid_loss)))
-                                result_file.write('precision: {}\n'.format(precision))
-                                result_file.write('recall: {}\n'.format(recall))
-                                result_file.close()
+                                write_result(para, prev_valid_loss, precision,
+                                             recall)
                             else:
                                 print()
 
@@ -188,22 +402,29 @@ if __name__ == "__main__":
                     start_time = time.time()
 
                     # get input data
-                    data = sess.run([
-                        model.raw_encoder_inputs,
-                        model.raw_encoder_inputs_len,
-                        model.raw_seed_song_inputs,
-                        model.raw_artist_inputs,
-                        model.raw_genre_inputs,
-                        model.raw_seed_artist_inputs,
-                        model.raw_seed_genre_inputs,
-                    ])
+                    if dataset is not None:
+                        batch = dataset.next_batch()
+                        data = [batch[0], batch[1], batch[4], batch[5],
+                                batch[6], batch[7], batch[8]]
+                    else:
+                        data = sess.run([
+                            model.raw_encoder_inputs,
+                            model.raw_encoder_inputs_len,
+                            model.raw_seed_song_inputs,
+                            model.raw_artist_inputs,
+                            model.raw_genre_inputs,
+                            model.raw_seed_artist_inputs,
+                            model.raw_seed_genre_inputs,
+                        ])
                     data = [e.astype(np.int32) for e in data]
 
                     # get sampled ids
-                    [sampled_ids] = sess.run(
-                        fetches=[
-                            model.sampled_ids,
-                        ],
+                    fetches = [model.sampled_ids]
+                    if para.sampling in ['top_k', 'nucleus']:
+                        # the update scores only the songs sampled from
+                        fetches.append(model.sampling_ids)
+                    rollout = sess.run(
+                        fetches=fetches,
                         feed_dict={
                             model.encoder_inputs: data[0],
                             model.encoder_inputs_len: data[1],
@@ -214,26 +435,30 @@ if __name__ == "__main__":
                             model.seed_genre_inputs: data[6]
                         }
                     )
+                    sampled_ids = rollout[0]
 
                     # get reward
                     rewards, msg = reward_functions(para, sampled_ids)
 
                     # feed rewards and update the model
+                    feed_dict = {
+                        model.encoder_inputs: data[0],
+                        model.encoder_inputs_len: data[1],
+                        model.seed_song_inputs: data[2],
+                        model.artist_inputs: data[3],
+                        model.genre_inputs: data[4],
+                        model.seed_artist_inputs: data[5],
+                        model.seed_genre_inputs: data[6],
+                        model.sampled_ids_inputs: sampled_ids,
+                        model.rewards: rewards
+                    }
+                    if len(rollout) > 1:
+                        feed_dict[model.sampling_ids_inputs] = rollout[1]
                     [_] = sess.run(
                         fetches=[
                             model.rl_update,
                         ],
-                        feed_dict={
-                            model.encoder_inputs: data[0],
-                            model.encoder_inputs_len: data[1],
-                            model.seed_song_inputs: data[2],
-                            model.artist_inputs: data[3],
-                            model.genre_inputs: data[4],
-                            model.seed_artist_inputs: data[5],
-                            model.seed_genre_inputs: data[6],
-                            model.sampled_ids_inputs: sampled_ids,
-                            model.rewards: rewards
-                        }
+                        feed_dict=feed_dict
                     )
 
                     step_time += (time.time() - start_time)
@@ -251,12 +476,18 @@ if __name__ == "__main__":
                     if para.debug:
                         break
 
+            elif para.mode == 'valid_worker':
+                run_valid_worker(para, sess, model, valid_set)
+
             elif para.mode =='valid':
                 for i in range(5):
+                    feed_dict = None
+                    if dataset is not None:
+                        feed_dict = model.batch_feed_dict(dataset.next_batch())
                     [loss, predict_count] = sess.run([
                         model.loss,
                         model.predict_count,
-                    ])
+                    ], feed_dict=feed_dict)
                     loss = loss * para.batch_size
                     perplexity = np.exp(loss / predict_count)
                     print('perplexity: %.2f' % perplexity)
@@ -290,6 +521,8 @@ if __name__ == "__main__":
             print('KeyboardInterrupt')
 
         finally:
+            if valid_worker is not None:
+                stop_valid_worker(para, valid_worker)
             print('Stop')
             coord.request_stop()
             coord.join(threads)
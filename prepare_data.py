@@ -0,0 +1,218 @@
+""" run the data preparation pipeline, skipping stages that are up to date
+
+    $ python3 prepare_data.py [--incremental] [--force]
+
+    Every stage is fingerprinted by the content of its input files (scripts
+    included) and its parameters. A stage runs again when its fingerprint
+    differs from the one of its last run or when one of its outputs was
+    changed or removed since. Fingerprints and the hashes of the input files
+    (cached by size and mtime, so unchanged files are not read again) are kept
+    in data/pipeline_state.json.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+root_dir = os.path.dirname(os.path.abspath(__file__))
+state_path = os.path.join(root_dir, 'data', 'pipeline_state.json')
+
+HASH_CHUNK = 1 << 22
+
+def stages(args):
+    """
+        (name, working directory, command, input files, parameters, outputs),
+        paths are relative to the repository, outputs may be glob patterns
+    """
+    splits = ['train', 'valid', 'test']
+    ids_outputs = []
+    for split in splits:
+        for name in ['raw_data', 'rerank_data', 'seed']:
+            ids_outputs.append('data/{}_{}.txt'.format(split, name))
+            ids_outputs.append('data/{}_ids_{}.txt'.format(split, name))
+        for name in ['raw_data', 'rerank_data']:
+            ids_outputs.append('data/{}_ids_{}.tokens.npy'.format(split, name))
+            ids_outputs.append('data/{}_ids_{}.offsets.npy'.format(split, name))
+        ids_outputs.append('data/{}_ids_seed.npy'.format(split))
+
+    tf_inputs = ['data/tf_format.py', 'lib/dataset.py', 'lib/utils.py',
+                 'data/vocab_default.txt', 'data/meta.txt',
+                 'data/artist.txt', 'data/genre.txt']
+    for split in ['train', 'valid']:
+        tf_inputs += ['data/{}_ids_raw_data.tokens.npy'.format(split),
+                      'data/{}_ids_raw_data.offsets.npy'.format(split),
+                      'data/{}_ids_rerank_data.tokens.npy'.format(split),
+                      'data/{}_ids_rerank_data.offsets.npy'.format(split),
+                      'data/{}_ids_seed.npy'.format(split)]
+    tf_outputs = ['data/{}_{}*.tfrecords'.format(nn, split)
+                  for nn in args.formats.split(',')
+                  for split in ['train', 'valid']]
+
+    return [
+        ('raw', 'data/raw',
+         ['prepare_raw_data.py', '--vocab_size', str(args.vocab_size),
+          '--num_buckets', str(args.num_buckets)],
+         ['data/raw/prepare_raw_data.py', 'data/raw/x.txt', 'data/raw/y.txt'],
+         {'vocab_size': args.vocab_size},
+         ['data/vocab_default.txt', 'data/raw/raw_data.txt',
+          'data/raw/rerank_data.txt']),
+        ('ids', 'data/raw',
+         ['prepare_ids_data.py', '--workers', str(args.workers)],
+         ['data/raw/prepare_ids_data.py', 'lib/dataset.py',
+          'data/vocab_default.txt', 'data/raw/raw_data.txt',
+          'data/raw/rerank_data.txt'],
+         {},
+         ids_outputs),
+        ('tf_format', 'data',
+         ['tf_format.py', '--max_len', str(args.max_len),
+          '--formats', args.formats, '--num_shards', str(args.num_shards),
+          '--workers', str(args.workers), '--compression', args.compression,
+          '--seed', str(args.seed)],
+         tf_inputs,
+         {'max_len': args.max_len, 'formats': args.formats,
+          'num_shards': args.num_shards, 'compression': args.compression,
+          'seed': args.seed},
+         tf_outputs),
+    ]
+
+def load_state():
+    if not os.path.exists(state_path):
+        return {'files': {}, 'stages': {}}
+    return json.load(open(state_path, 'r'))
+
+def save_state(state):
+    json.dump(state, open(state_path + '.tmp', 'w'), indent=2, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+
+def file_hash(path, file_cache):
+    """ sha1 of the file, recomputed only when its size or mtime changed """
+    stat = os.stat(os.path.join(root_dir, path))
+    cached = file_cache.get(path)
+    if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime]:
+        return cached[2]
+    sha1 = hashlib.sha1()
+    with open(os.path.join(root_dir, path), 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(HASH_CHUNK), b''):
+            sha1.update(chunk)
+    file_cache[path] = [stat.st_size, stat.st_mtime, sha1.hexdigest()]
+    return file_cache[path][2]
+
+def fingerprint(name, inputs, params, file_cache):
+    sha1 = hashlib.sha1(name.encode('utf-8'))
+    sha1.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for path in inputs:
+        sha1.update(path.encode('utf-8'))
+        sha1.update(file_hash(path, file_cache).encode('utf-8'))
+    return sha1.hexdigest()
+
+def output_stats(outputs):
+    """ {path: [size, mtime]} of every output, None if one is missing """
+    stats = {}
+    for pattern in outputs:
+        paths = sorted(glob.glob(os.path.join(root_dir, pattern)))
+        if len(paths) == 0:
+            return None
+        for path in paths:
+            stat = os.stat(path)
+            stats[os.path.relpath(path, root_dir)] = [stat.st_size,
+                                                      stat.st_mtime]
+    return stats
+
+def up_to_date(stage_state, key, outputs):
+    if stage_state is None or stage_state['fingerprint'] != key:
+        return False
+    return output_stats(outputs) == stage_state['outputs']
+
+def run(cwd, cmd):
+    start = time.time()
+    subprocess.check_call([sys.executable] + cmd,
+                          cwd=os.path.join(root_dir, cwd))
+    return time.time() - start
+
+def run_pipeline(args, report):
+    state = load_state()
+    for name, cwd, cmd, inputs, params, outputs in stages(args):
+        missing = [path for path in inputs
+                   if not os.path.exists(os.path.join(root_dir, path))]
+        if missing:
+            raise FileNotFoundError('{}: missing {}'.format(
+                name, ', '.join(missing)
+            ))
+        start = time.time()
+        key = fingerprint(name, inputs, params, state['files'])
+        if not args.force and \
+           up_to_date(state['stages'].get(name), key, outputs):
+            report.append((name, 'skipped', time.time() - start))
+            continue
+
+        print('running {}: {}'.format(name, ' '.join(cmd)))
+        # forget the stage first, an interrupted run is never up to date
+        state['stages'].pop(name, None)
+        save_state(state)
+        seconds = run(cwd, cmd)
+        state['stages'][name] = {
+            'fingerprint': key,
+            'outputs': output_stats(outputs),
+            'seconds': seconds,
+        }
+        save_state(state)
+        report.append((name, 'ran', time.time() - start))
+
+def run_incremental(args, report):
+    """ the incremental scripts keep their own state, they always run """
+    state = load_state()
+    state['stages'] = {}
+    save_state(state)
+    report.append(('incremental', 'ran', run('data/raw', [
+        'prepare_incremental.py', '--vocab_size', str(args.vocab_size),
+        '--workers', str(args.workers), '--num_buckets', str(args.num_buckets),
+        '--rebuild_threshold', str(args.rebuild_threshold)
+    ])))
+    report.append(('tf_format', 'ran', run('data', [
+        'tf_format.py', '--incremental', '1', '--max_len', str(args.max_len),
+        '--formats', args.formats, '--num_shards', str(args.num_shards),
+        '--workers', str(args.workers), '--compression', args.compression,
+        '--seed', str(args.seed)
+    ])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process playlists appended to x.txt / y.txt')
+    parser.add_argument('--force', action='store_true',
+                        help='run every stage')
+    parser.add_argument('--rebuild_threshold', type=float, default=0.01,
+                        help='with --incremental, rebuild everything when '
+                             'more than this fraction of the vocab would '
+                             'change')
+    parser.add_argument('--vocab_size', type=int, default=70000, help='')
+    parser.add_argument('--max_len', type=int, default=210, help='')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='does not change the outputs')
+    parser.add_argument('--num_buckets', type=int, default=0,
+                        help='buckets of the join of x.txt and y.txt, 0 '
+                             'derives it from their size, does not change '
+                             'the outputs')
+    parser.add_argument('--formats', type=str, default='cnn,rnn', help='')
+    parser.add_argument('--num_shards', type=int, default=16, help='')
+    parser.add_argument('--compression', type=str, default='none',
+                        choices=['none', 'gzip', 'zlib'],
+                        help='must match --compression of main.py')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='of the shuffled order of the .tfrecords')
+    args = parser.parse_args()
+
+    report = []
+    try:
+        if args.incremental:
+            run_incremental(args, report)
+        else:
+            run_pipeline(args, report)
+    finally:
+        for name, status, seconds in report:
+            print('{:10s} {:8s} {:.2f}s'.format(name, status, seconds))